@@ -1,43 +1,124 @@
-import argparse
+import bisect
+import collections
+import functools
+import hashlib
+import heapq
 import importlib
+import itertools
+import json
 import logging
-import pdb
+import os
 import sys
-from copy import deepcopy
-from calendar import monthrange
-from datetime import timedelta
-from pkg_resources import get_distribution
-from queue import Queue
-try:
-    from signal import (
-        SIGALRM,
-        alarm,
-        signal,
-    )
-except ImportError:
-    SIGALARM = alarm = signal = None
-from time import sleep
+import threading
+import uuid
+from calendar import isleap
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from time import monotonic, time
 
 import pendulum
 
-from dramatiq.middleware import SkipMessage
-from django.core.management.base import OutputWrapper
-import traceback
+import dramatiq
+from dramatiq.middleware import Retries, SkipMessage
 from dramatiq import Middleware
-from dramatiq.cli import (
-    import_broker,
-)
 
-stdout = OutputWrapper(sys.stdout)
 
 logger = logging.getLogger('periodiq')
 
 
-def cron(spec):
-    return CronSpec.parse(spec)
+def cron(spec, tz=None):
+    # Evaluate spec in timezone tz, e.g. 'Europe/Paris'. Defaults to local
+    # timezone.
+    return CronSpec.parse(spec, tz)
+
+
+def every(seconds=0, minutes=0, hours=0):
+    # Fire every interval, aligned on epoch. e.g. every(seconds=5) fires at
+    # seconds 0, 5, 10, etc. of each minute.
+    return Interval(hours * 3600 + minutes * 60 + seconds)
+
+
+class CronArray:
+    # Evaluate many CronSpecs against many minutes at once with NumPy. Times
+    # are naive numpy.datetime64, in the wall-clock time of specs. Seconds
+    # field is ignored.
+
+    def __init__(self, specs):
+        # NumPy is optional, import it only when needed.
+        import numpy
+
+        self.numpy = numpy
+        self.specs = list(specs)
+        # Lookup tables of valid values, one row per spec.
+        minute = bits_table(numpy, [s.minute_mask for s in self.specs], 60)
+        hour = bits_table(numpy, [s.hour_mask for s in self.specs], 24)
+        self.dom = bits_table(numpy, [s.dom_mask for s in self.specs], 32)
+        self.month = bits_table(numpy, [s.month_mask for s in self.specs], 13)
+        self.weekday = bits_table(
+            numpy, [s.weekday_mask for s in self.specs], 7)
+        self.either = numpy.array([
+            s.is_dom_restricted and s.is_dow_restricted for s in self.specs
+        ], dtype=bool)[:, None]
+        # Valid minutes of day, one row per spec.
+        self.time_of_day = (
+            minute[:, numpy.tile(numpy.arange(60), 24)] &
+            hour[:, numpy.repeat(numpy.arange(24), 60)]
+        )
+
+    def matrix(self, times):
+        # Returns a boolean matrix of specs × times, True where spec is valid.
+        numpy = self.numpy
+        times = numpy.asarray(times, dtype='datetime64[m]')
+        minutes = times.astype(numpy.int64)
+        # Evaluate day criteria once per day.
+        days, inverse = numpy.unique(minutes // 1440, return_inverse=True)
+        dates = days.astype('datetime64[D]')
+        months = dates.astype('datetime64[M]')
+        month = months.astype(numpy.int64) % 12 + 1
+        dom = (dates - months.astype('datetime64[D]')).astype(numpy.int64) + 1
+        # 1970-01-01 is a Thursday.
+        weekday = (days + 4) % 7
+
+        dom_ok = self.dom[:, dom]
+        dow_ok = self.weekday[:, weekday]
+        day_ok = self.month[:, month] & numpy.where(
+            self.either, dom_ok | dow_ok, dom_ok & dow_ok)
+        return day_ok[:, inverse.ravel()] & self.time_of_day[:, minutes % 1440]
+
+    def pairs(self, times, chunk=10080):
+        # Returns (spec indexes, times) arrays of valid pairs, ordered by time.
+        # Times are evaluated by chunk of one week to bound memory.
+        numpy = self.numpy
+        times = numpy.asarray(times, dtype='datetime64[m]')
+        indexes, dates = [], []
+        for i in range(0, len(times), chunk):
+            part = times[i:i + chunk]
+            time_i, spec_i = numpy.nonzero(self.matrix(part).T)
+            indexes.append(spec_i)
+            dates.append(part[time_i])
+        if not indexes:
+            return (
+                numpy.empty(0, dtype=numpy.intp),
+                numpy.empty(0, dtype='datetime64[m]'),
+            )
+        return numpy.concatenate(indexes), numpy.concatenate(dates)
 
 
 class CronSpec:
+    # Each field is compiled as a bitmask where bit x is set if x is a valid
+    # value. All masks fit in 64 bits. Slots avoid a __dict__ per spec.
+    #
+    # An optional leading sixth field gives seconds. Without it, specs fire at
+    # second 0 and have minute resolution.
+    #
+    # CronSpec is immutable. parse() and intern() are cached and return the
+    # same object for the same spec and timezone.
+    __slots__ = (
+        'minute_mask', 'hour_mask', 'dom_mask', 'month_mask', 'dow_mask',
+        'weekday_mask', 'is_dom_restricted', 'is_dow_restricted',
+        'second_mask', 'has_seconds', 'is_sub_daily', 'parsed_from', 'tz',
+    )
+
     _named_spec = {
         '@yearly': "0 0 1 1 *",
         '@annually': "0 0 1 1 *",
@@ -49,13 +130,29 @@ class CronSpec:
     }
 
     @classmethod
-    def parse(cls, spec):
-        # Instanciate a CronSpec object from cron-like string.
+    @functools.lru_cache(maxsize=1024)
+    def intern(cls, minute_mask, hour_mask, dom_mask, month_mask, dow_mask,
+               tz=None, second_mask=None):
+        # Instanciate a CronSpec object from bitmasks.
+        self = cls.__new__(cls)
+        self.setup(
+            minute_mask, hour_mask, dom_mask, month_mask, dow_mask, tz=tz,
+            second_mask=second_mask)
+        return self
+
+    @classmethod
+    @functools.lru_cache(maxsize=1024)
+    def parse(cls, spec, tz=None):
+        # Instanciate a CronSpec object from cron-like string. Use
+        # CronSpec.parse.cache_info() to get cache statistics.
 
         fields = spec.strip()
         if fields.startswith('@'):
             fields = cls._named_spec[fields]
         fields = fields.split()
+        seconds = None
+        if 6 == len(fields):
+            seconds = expand_valid(fields.pop(0), min=0, max=59)
 
         # Replace day of week by their number.
         dow = fields[4].lower()
@@ -70,20 +167,51 @@ class CronSpec:
             month=expand_valid(fields[3], min=1, max=12),
             dow=expand_valid(dow, min=0, max=7),
             parsed_from=spec,
+            tz=tz,
+            s=seconds,
         )
 
-    def __init__(self, m, h, dom, month, dow, parsed_from=None):
-        self.setup(m, h, dom, month, dow)
-        self.parsed_from = parsed_from
+    def __init__(self, m, h, dom, month, dow, parsed_from=None, tz=None,
+                 s=None):
+        self.setup(
+            to_mask(m), to_mask(h), to_mask(dom), to_mask(month), to_mask(dow),
+            parsed_from=parsed_from, tz=tz,
+            second_mask=None if s is None else to_mask(s),
+        )
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __delattr__(self, name):
+        raise AttributeError("CronSpec is immutable.")
 
     def __eq__(self, other):
-        return self.astuple() == other.astuple()
+        if not isinstance(other, CronSpec):
+            return NotImplemented
+        return self.askey() == other.askey()
+
+    def __hash__(self):
+        return hash(self.askey())
+
+    def __reduce__(self):
+        if self.parsed_from is not None:
+            return self.parse, (self.parsed_from, self.tz)
+        return self.intern, self.askey()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CronSpec is immutable.")
 
     def __str__(self):
         if self.parsed_from is not None:
             return self.parsed_from
         else:
-            return ' '.join([
+            seconds = []
+            if self.has_seconds:
+                seconds = [format_cron(self.second, min_=0, max_=59)]
+            return ' '.join(seconds + [
                 format_cron(self.minute, min_=0, max_=59),
                 format_cron(self.hour, min_=0, max_=23),
                 format_cron(self.dom, min_=1, max_=31),
@@ -94,127 +222,328 @@ class CronSpec:
             ])
 
     def __repr__(self):
+        if self.tz is not None:
+            return '<%s %s %s>' % (self.__class__.__name__, self, self.tz)
         return '<%s %s>' % (self.__class__.__name__, self)
 
+    def asmasks(self):
+        return (
+            self.minute_mask, self.hour_mask, self.dom_mask, self.month_mask,
+            self.dow_mask,
+        )
+
+    def askey(self):
+        # Arguments of intern(), identifying this spec.
+        second_mask = self.second_mask if self.has_seconds else None
+        return self.asmasks() + (self.tz, second_mask)
+
     def astuple(self):
         return self.minute, self.hour, self.dom, self.month, self.dow
 
+    @property
+    def second(self):
+        return bits(self.second_mask)
+
+    @property
+    def minute(self):
+        return bits(self.minute_mask)
+
+    @property
+    def hour(self):
+        return bits(self.hour_mask)
+
+    @property
+    def dom(self):
+        return bits(self.dom_mask)
+
+    @property
+    def month(self):
+        return bits(self.month_mask)
+
+    @property
+    def dow(self):
+        return bits(self.dow_mask)
+
+    def iter_dates(self, start, end=None):
+        # Yield valid dates after start, up to end included if not None.
+        start = self.localize(start)
+        tz = start.tzinfo
+        timestamp = datetime.timestamp(start)
+        if end is not None:
+            end = datetime.timestamp(end)
+        while True:
+            # Move forward in absolute time, to walk through repeated
+            # wall-clock time when DST ends like next_valid_date().
+            timestamp = self.next_timestamp(timestamp, tz)
+            if end is not None and timestamp > end:
+                return
+            yield timestamp_to_date(timestamp, tz)
+
+    def localize(self, date):
+        # Convert date to the timezone of this spec, if any. Dates already in
+        # this timezone are returned as is.
+        if self.tz is None or getattr(date.tzinfo, 'name', None) == self.tz:
+            return date
+        return date.in_timezone(self.tz)
+
+    def next_n(self, start, count):
+        # List the count next valid dates after start.
+        return list(itertools.islice(self.iter_dates(start), count))
+
+    def next_timestamp(self, timestamp, tz):
+        # Timestamp of next valid date after timestamp, in timezone tz. Search
+        # runs on wall-clock integers and translates through timestamps,
+        # without pendulum arithmetic which costs ~10x more.
+
+        # Reset microsecond, and second unless spec has seconds. It's
+        # irrelevant for scheduling. Next date is at least in one second or
+        # one minute.
+        timestamp = int(timestamp // 1)
+        if self.has_seconds:
+            timestamp += 1
+        else:
+            timestamp += 60 - datetime.fromtimestamp(timestamp, tz).second
+        local = datetime.fromtimestamp(timestamp, tz)
+        second = local.second
+        wall = (local.year, local.month, local.day, local.hour, local.minute)
+        origin = ordinal_minutes(*wall)
+        seconds = self.second_mask >> second << second
+        # Search from next minute if no second is left in this one.
+        found = wall if seconds else wall[:4] + (wall[4] + 1,)
+        while True:
+            found = self.search(*found)
+            n = wall_to_timestamp(timestamp - second, origin, found, tz)
+            if n is not None:
+                break
+            # found does not exist in this timezone. Search after it.
+            year, month, day, hour, minute = found
+            found = year, month, day, hour, minute + 1
+
+        if self.is_sub_daily and n - (timestamp - second) > (
+                ordinal_minutes(*found) - origin) * 60:
+            # Clock went back in between, when DST ends. Walk through
+            # repeated wall-clock time like other times. Daily specs run
+            # once.
+            return self.search_repeated(timestamp, n, tz)
+        return n + lowest_set_bit(
+            seconds if found == wall else self.second_mask)
+
     def next_valid_date(self, last):
         # Note about DST. periodiq uses pendulum to have timezone-aware, always
         # valid date. For example, 2019-03-31T02:*:* does not exists in
-        # timezone Europe/Paris. Using pendulum .add() methods never produces
-        # invalid date. Also, pendulum.now() is always at right timezone.
-
-        # Reset second and microsecond. It's irrelevant for scheduling.
-        n = last.replace(second=0, microsecond=0)
-
-        # Next date is at least in one minute.
-        n = n.add(minutes=1)
-
-        # How much minutes to way until next valid minute?
-        delay_m = first(lambda x: x >= n.minute, self.minute_e) - n.minute
-        n = n.add(minutes=delay_m)
-
-        # How much hours to wait until next valid hour?
-        delay_h = first(lambda x: x >= n.hour, self.hour_e) - n.hour
-        n = n.add(hours=delay_h)
-
-        # How much days to wait until next valid weekday?
-        last_dow = n.isoweekday() % 7
-        delay_dow = first(lambda x: x >= last_dow, self.dow_e) - last_dow
-
-        # How much days to wait until next valid monthday?
-        _, month_days = monthrange(n.year, n.month)
-        # Drop irrelevant day of month (28+ or 31+) and adapt offset according
-        # to current month.
-        dom_e = [
-            x for x in self.dom if x <= month_days
-        ] + [month_days + self.dom[0]]
-        delay_dom = first(lambda x: x >= n.day, dom_e) - n.day
+        # timezone Europe/Paris. Such wall-clock time is skipped and search
+        # continues to next valid one. Also, pendulum.now() is always at right
+        # timezone.
+        #
+        # The search runs on plain wall-clock integers. Pendulum is used only
+        # to translate the result back to a timezone-aware date.
+        return next(self.iter_dates(last))
+
+    def search(self, year, month, day, hour, minute):
+        # Return first valid (year, month, day, hour, minute) at or after
+        # wall-clock time. Fields may overflow, e.g. minute=60 is carried to
+        # next hour.
+        limit = year + 400  # Gregorian calendar cycle.
+        cached = None
+        while year < limit:
+            if not self.month_mask >> month & 1:
+                month = next_set_bit(self.month_mask, month, 12)
+                if month > 12:
+                    year, month = year + 1, month - 12
+                day, hour, minute = 1, 0, 0
+
+            # Overflowing hours revisit the same month, compute its days once.
+            if cached != (year, month):
+                cached = year, month
+                valid_days = self.valid_days(year, month)
+            days = valid_days >> day << day
+            if not days:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                continue
+            next_day = lowest_set_bit(days)
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+
+            hours = self.hour_mask >> hour << hour
+            if not hours:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            next_hour = lowest_set_bit(hours)
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+
+            minutes = self.minute_mask >> minute << minute
+            if not minutes:
+                hour, minute = hour + 1, 0
+                continue
+            return year, month, day, hour, lowest_set_bit(minutes)
+
+        raise ValueError("No matching date.")
+
+    def search_repeated(self, start, end, tz):
+        # Timestamp of first valid date after start, knowing that clock goes
+        # back once before end, the first valid date in wall-clock order.
+        # Bisect the transition, then search from wall-clock time after it.
+        offset = datetime.fromtimestamp(start, tz).utcoffset()
+        transition = end
+        while transition - start > 1:
+            middle = (start + transition) // 2
+            if datetime.fromtimestamp(middle, tz).utcoffset() == offset:
+                start = middle
+            else:
+                transition = middle
+        local = datetime.fromtimestamp(transition, tz)
+        wall = (local.year, local.month, local.day, local.hour, local.minute)
+        n = wall_to_timestamp(
+            transition - local.second, ordinal_minutes(*wall),
+            self.search(*wall), tz)
+        if n is None or n < transition or n >= end:
+            return end + lowest_set_bit(self.second_mask)
+        return n + lowest_set_bit(self.second_mask)
+
+    def valid_days(self, year, month):
+        # Bitmask of valid days in month, bit 1 being the first of month.
+        month_mask = (2 << days_in_month(year, month)) - 2
+        dom = self.dom_mask & month_mask
+        # Rotate weekday mask so that bit 0 is the weekday of the first of
+        # month. Then repeat it over 5 weeks.
+        first = date(year, month, 1).isoweekday() % 7
+        week = (
+            self.weekday_mask >> first | self.weekday_mask << (7 - first)
+        ) & 0x7f
+        dow = (week * 0x10204081) << 1 & month_mask
 
         if self.is_dow_restricted and self.is_dom_restricted:
-            # Choose closest day matching dom or dow criteria
-            delay_d = min(delay_dow, delay_dom)
+            # Match either dom or dow criteria.
+            return dom | dow
         else:
-            delay_d = delay_dow if self.is_dow_restricted else delay_dom
-
-        n = n.add(days=delay_d)
-
-        # How much days to wait until next valid month?
-        next_month = first(lambda x: x >= n.month, self.month_e)
-        delay_d = sum(monthesrange(n.year, n.month, next_month))
-        n = n.add(days=delay_d)
-
-        return n
-
-    def replace(self, m=None, h=None, dom=None, month=None, dow=None):
-        copy = deepcopy(self)
-        copy.setup(m, h, dom, month, dow)
-        return copy
-
-    def setup(self, m, h, dom, month, dow):
-        # For each field, we compute the next valid value out of bound. i.e if
-        # valids minutes are [25, 50], appending 75 will ensure there is always
-        # a next valid value for any minute between 0 and 59. timedelta will
-        # ensure out of bound minutes are translated to next hour.
-        if m is not None:
-            self.minute = m
-            self.minute_e = m + [60 + m[0]]
-        if h is not None:
-            self.hour = h
-            self.hour_e = h + [24 + h[0]]
-        if dom is not None:
-            self.is_dom_restricted = len(dom) < 31
-            self.dom = dom
-        if month is not None:
-            self.month = month
-            self.month_e = month + [12 + month[0]]
-        if dow is not None:
-            self.is_dow_restricted = len(dow) < 7
-            self.dow = dow
-            self.dow_e = dow + [7 + dow[0]]
-        # Invalidate string representation.
-        self.parsed_from = None
+            return dom & dow
+
+    def replace(self, m=None, h=None, dom=None, month=None, dow=None,
+                tz=None, s=None):
+        # Returns an interned spec with some fields or timezone replaced.
+        # String representation is rebuilt from fields.
+        second_mask = self.askey()[-1]
+        fields = zip((m, h, dom, month, dow), self.asmasks())
+        masks = [
+            mask if values is None else to_mask(values)
+            for values, mask in fields
+        ]
+        # Pass all arguments positionally, as __reduce__, to share cache
+        # entry.
+        return self.intern(*masks + [
+            self.tz if tz is None else tz,
+            second_mask if s is None else to_mask(s),
+        ])
+
+    def setup(self, minute_mask, hour_mask, dom_mask, month_mask, dow_mask,
+              parsed_from=None, tz=None, second_mask=None):
+        # Searching next valid value from bitmasks is a matter of bit
+        # shifting, see next_set_bit(). Bypass immutability while building.
+        if tz is not None:
+            # Fail early on unknown timezone.
+            pendulum.timezone(tz)
+        weekday_mask = (dow_mask | dow_mask >> 7) & 0x7f
+        for name, value in (
+                ('minute_mask', minute_mask),
+                ('hour_mask', hour_mask),
+                ('dom_mask', dom_mask),
+                ('is_dom_restricted', popcount(dom_mask) < 31),
+                ('month_mask', month_mask),
+                ('dow_mask', dow_mask),
+                # Sunday is either 0 or 7. Fold 7 on 0 for matching.
+                ('weekday_mask', weekday_mask),
+                ('is_dow_restricted', weekday_mask != 0x7f),
+                # Without seconds field, fire at second 0.
+                ('second_mask', 1 if second_mask is None else second_mask),
+                ('has_seconds', second_mask is not None),
+                # Fires several times a day, e.g. in the hour repeated when
+                # DST ends.
+                ('is_sub_daily', popcount(minute_mask) * popcount(hour_mask) *
+                 popcount(1 if second_mask is None else second_mask) > 1),
+                ('parsed_from', parsed_from),
+                ('tz', tz),
+        ):
+            object.__setattr__(self, name, value)
 
     def validate(self, date):
         # Returns whether this date match the specified constraints.
+        date = self.localize(date)
+
+        if self.has_seconds and not self.second_mask >> date.second & 1:
+            return False
 
-        if date.minute not in self.minute:
+        if not self.minute_mask >> date.minute & 1:
             return False
 
-        if date.hour not in self.hour:
+        if not self.hour_mask >> date.hour & 1:
             return False
 
-        if date.month not in self.month:
+        if not self.month_mask >> date.month & 1:
             return False
 
-        weekday = date.isoweekday()
+        dom = self.dom_mask >> date.day & 1
+        dow = self.weekday_mask >> (date.isoweekday() % 7) & 1
         if self.is_dow_restricted and self.is_dom_restricted:
-            if not (date.day in self.dom or weekday in self.dow):
-                return False
+            return bool(dom or dow)
         else:
-            if date.day not in self.dom:
-                return False
-            if weekday not in self.dow:
-                return False
+            return bool(dom and dow)
+
+
+def bits(mask):
+    # List set bits of mask, lowest first.
+    return [x for x in range(mask.bit_length()) if mask >> x & 1]
+
+
+def bits_table(numpy, masks, size):
+    # Expand bitmasks as a boolean table of len(masks) × size.
+    masks = numpy.array(masks, dtype=numpy.uint64)
+    shifts = numpy.arange(size, dtype=numpy.uint64)
+    return (masks[:, None] >> shifts & numpy.uint64(1)).astype(bool)
+
+
+def collect_actors(broker, shard=None):
+    # List periodic actors of broker, only those of shard (index, count) if
+    # set.
+    actors = [a for a in broker.actors.values() if 'periodic' in a.options]
+    if shard is not None:
+        index, count = shard
+        actors = [a for a in actors if shard_of(a.actor_name, count) == index]
+    return actors
+
+
+def days_in_month(year, month):
+    if 2 == month:
+        return 29 if isleap(year) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
 
-        return True
 
+def entrypoint(broker, modules, verbose, path, **kw):
+    from bdb import BdbQuit
 
-def entrypoint(broker, modules, verbose, path):
     try:
-        exit(main(broker=broker, modules=modules, verbose=verbose, path=path))
-    except (pdb.bdb.BdbQuit, KeyboardInterrupt):
-        stdout.write("Interrupted.")
+        exit(main(
+            broker=broker, modules=modules, verbose=verbose, path=path, **kw))
+    except (BdbQuit, KeyboardInterrupt):
+        logger.info("Interrupted.")
     except Exception as e:
-        stdout.write('Unhandled error: {}, stack: {}'.format(e, traceback.format_exc()))
-        stdout.write(
+        logger.exception("Unhandled error: %s.", e)
+        logger.error(
             "Please file an issue at "
             "https://gitlab.com/bersace/periodiq/issues/new with full log.",
         )
     exit(1)
 
 
+def enqueue_batch(broker, messages):
+    # Enqueue messages of a single queue, in one batch if broker supports it.
+    if hasattr(broker, 'enqueue_many'):
+        broker.enqueue_many(messages)
+    else:
+        for message in messages:
+            broker.enqueue(message)
+
+
 def expand_valid(value, min, max):
     # From cron-like time or date field, expand all valid values within min-max
     # interval.
@@ -233,12 +562,33 @@ def expand_valid(value, min, max):
     return sorted(valid)
 
 
-def first(function, iterable):
-    # Return the first item from iterable accepted by function.
-    try:
-        return next(x for x in iterable if function(x))
-    except StopIteration:
-        raise ValueError("No matching value.")
+class FileCheckpoint:
+    # Persist last fired date by actor name in a JSON file.
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as fo:
+                data = json.load(fo)
+        except FileNotFoundError:
+            return {}
+        tz = pendulum.local_timezone()
+        return {
+            name: pendulum.parse(date).in_timezone(tz)
+            for name, date in data.items()
+        }
+
+    def save(self, last_fired):
+        # Write a temporary file and rename it, so that a crash never leaves
+        # a truncated checkpoint.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fo:
+            json.dump({
+                name: date.isoformat() for name, date in last_fired.items()
+            }, fo)
+        os.replace(tmp, self.path)
 
 
 def format_cron(values, min_, max_, names=None):
@@ -260,6 +610,16 @@ def format_interval(start, stop, names=None):
         return '%s-%s' % (start, stop)
 
 
+def format_labels(labels):
+    # Format ((name, value), ...) as Prometheus labels.
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
 def group_intervals(values):
     last = values[0]
     start = last
@@ -272,55 +632,390 @@ def group_intervals(values):
     yield start, last
 
 
-def monthesrange(start_year, start_month, end_month):
-    # Switch to zero-base month numbering.
-    start_month -= 1
-    end_month -= 1
-    return (
-        x for _, x in (
-            monthrange(start_year + m // 12, 1 + m % 12)
-            for m in range(start_month, end_month)
-        )
+class LocalLease:
+    # In-process stand-in for RedisLease, for tests and single host setups.
+    # Leases with the same key share holders.
+    holders = {}
+    lock = threading.Lock()
+
+    def __init__(self, key='periodiq-leader', ttl=10, token=None):
+        self.key = key
+        self.ttl = ttl
+        self.token = token or uuid.uuid4().hex
+
+    def acquire(self):
+        # Acquire or renew lease. Returns whether we hold the lease.
+        with self.lock:
+            now = monotonic()
+            token, expires = self.holders.get(self.key, (None, now))
+            if token not in (None, self.token) and expires > now:
+                return False
+            self.holders[self.key] = self.token, now + self.ttl
+            return True
+
+    def release(self):
+        with self.lock:
+            token, _ = self.holders.get(self.key, (None, None))
+            if token == self.token:
+                del self.holders[self.key]
+
+
+@functools.lru_cache(maxsize=16)
+def hash_ring(count, replicas=64):
+    # Place replicas points per shard on a hash ring. Returns sorted points
+    # and their shard.
+    ring = sorted(
+        (stable_hash('%s-%s' % (shard, replica)), shard)
+        for shard in range(count)
+        for replica in range(replicas)
     )
+    return [p for p, _ in ring], [s for _, s in ring]
+
+
+class Interval:
+    # Schedule at fixed interval of seconds since epoch. Implements the same
+    # scheduling API as CronSpec.
+    __slots__ = ('seconds',)
 
+    has_seconds = True
+    tz = None
 
-def main(broker, modules, path, verbose=logging.DEBUG, ):
-    logger.setLevel(verbose)
-    if alarm is None:
-        stdout.write("Unsupported system: alarm syscall is not available.")
-        return 1
+    def __init__(self, seconds):
+        if int(seconds) != seconds or seconds < 1:
+            raise ValueError("Interval must be a positive number of seconds.")
+        self.seconds = int(seconds)
 
-    stdout.write("Starting Periodiq, a simple scheduler for Dramatiq.")
+    def __eq__(self, other):
+        if not isinstance(other, Interval):
+            return NotImplemented
+        return self.seconds == other.seconds
 
-    for _path in path:
-        sys.path.insert(0, _path)
-    _, broker = import_broker(broker)
-    for module in modules:
-        importlib.import_module(module)
+    def __hash__(self):
+        return hash((Interval, self.seconds))
 
-    periodic_actors = [
-        a for a in broker.actors.values()
-        if 'periodic' in a.options
-    ]
-    if not periodic_actors:
-        stdout.write("No periodic actor to schedule.")
-        return 1
-    print_periodic_actors(periodic_actors)
+    def __reduce__(self):
+        return Interval, (self.seconds,)
 
-    scheduler = Scheduler(actors=periodic_actors)
-    now = pendulum.now()
-    # If we start late in a minute. Pad to start of next minute.
-    if now.second > 55:
-        stdout.write("Skipping to next minute.")
-        sleep(60 - now.second)
-    scheduler.schedule()
-    scheduler.loop()
+    def __str__(self):
+        return '@every %ss' % self.seconds
 
-    return 0
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self)
+
+    def iter_dates(self, start, end=None):
+        # Yield multiples of interval after start, up to end included if not
+        # None. Integer arithmetic on timestamps is not affected by DST.
+        tz = start.tzinfo
+        timestamp = datetime.timestamp(start)
+        if end is not None:
+            end = datetime.timestamp(end)
+        while True:
+            timestamp = self.next_timestamp(timestamp, tz)
+            if end is not None and timestamp > end:
+                return
+            yield timestamp_to_date(timestamp, tz)
+
+    def localize(self, date):
+        return date
+
+    def next_n(self, start, count):
+        return list(itertools.islice(self.iter_dates(start), count))
+
+    def next_timestamp(self, timestamp, tz):
+        # Timezone doesn't matter, interval is aligned on epoch.
+        return (int(timestamp) // self.seconds + 1) * self.seconds
+
+    def next_valid_date(self, last):
+        return next(self.iter_dates(last))
+
+    def validate(self, date):
+        return 0 == int(date.timestamp()) % self.seconds
+
+
+class LocalStore:
+    # In-process key store with expiration. Stand-in for RedisStore, e.g.
+    # with StubBroker.
+
+    def __init__(self):
+        self.keys = {}
+        # Expiration of tokens holding a slot, by key.
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, token, limit, ttl):
+        # Hold one of limit slots of key with token, for ttl seconds unless
+        # released. Returns whether a slot was free.
+        with self.lock:
+            now = monotonic()
+            slots = self.slots.setdefault(key, {})
+            for expired in [t for t, e in slots.items() if e <= now]:
+                del slots[expired]
+            if len(slots) >= limit:
+                return False
+            slots[token] = now + ttl
+            return True
+
+    def add(self, key, ttl):
+        # Add key for ttl seconds unless present. Returns whether key was
+        # added.
+        with self.lock:
+            now = monotonic()
+            if self.keys.get(key, now) > now:
+                return False
+            if len(self.keys) > 10000:
+                # Purge expired keys.
+                self.keys = {k: t for k, t in self.keys.items() if t > now}
+            self.keys[key] = now + ttl
+            return True
+
+    def release(self, key, token):
+        with self.lock:
+            self.slots.get(key, {}).pop(token, None)
+
+
+def load_spec(spec, tz=None):
+    # Parse spec as formatted by str(), either cron-like or @every interval.
+    if spec.startswith('@every '):
+        return Interval(int(spec[7:].rstrip('s')))
+    return CronSpec.parse(spec, tz)
+
+
+class LoadProfile:
+    # Histogram of runs per minute by queue, over days from start. Bins are
+    # minutes since start, floored to the minute, including spread offsets.
+    #
+    # Cron specs are expanded day by day from their masks: each valid day
+    # adds the minutes selected by hour and minute masks, without walking
+    # through minutes nor dates. Actors sharing spec, queue and offset are
+    # counted once. Intervals, and specs whose timezone changes offset within
+    # the period, walk through their runs instead.
+
+    def __init__(self, actors, start, days=1, spread=0):
+        self.start = start.replace(second=0, microsecond=0)
+        self.first = int(self.start.timestamp())
+        self.last = int(self.start.add(days=days).timestamp())
+        self.minutes = (self.last - self.first) // 60
+        # List of runs per minute, by queue name.
+        self.histograms = {}
+        groups = collections.Counter(
+            (
+                actor.options['periodic'], actor.queue_name,
+                spread_offset(actor.actor_name, actor.options.get(
+                    'periodic_spread', spread)),
+            )
+            for actor in actors)
+        for (spec, queue, offset), count in groups.items():
+            self.add(spec, queue, offset, count)
+
+    def add(self, spec, queue, offset=0, count=1):
+        # Count runs of count actors of queue, scheduled by spec and delayed
+        # by offset seconds.
+        histogram = self.histograms.get(queue)
+        if histogram is None:
+            histogram = self.histograms[queue] = [0] * self.minutes
+        tz = spec.localize(self.start).tzinfo
+        fixed = (
+            datetime.fromtimestamp(self.first, tz).utcoffset() ==
+            datetime.fromtimestamp(self.last, tz).utcoffset())
+        if isinstance(spec, CronSpec) and fixed:
+            # Offset shifts runs of each second to the same minute bins.
+            shifts = collections.Counter(
+                int((second + offset) // 60) for second in spec.second)
+            for minute in self.expand(spec, tz):
+                for shift, runs in shifts.items():
+                    if minute + shift < self.minutes:
+                        histogram[minute + shift] += runs * count
+        else:
+            for second in self.walk(spec, tz):
+                minute = int((second + offset) // 60)
+                if minute < self.minutes:
+                    histogram[minute] += count
+
+    def expand(self, spec, tz):
+        # Yield minutes since start of runs of spec. Assumes tz offset is
+        # fixed over the period: wall-clock minutes then map to elapsed
+        # minutes.
+        local = datetime.fromtimestamp(self.first, tz)
+        origin = ordinal_minutes(
+            local.year, local.month, local.day, local.hour, local.minute)
+        times = [hour * 60 + minute
+                 for hour in spec.hour for minute in spec.minute]
+        day = local.date()
+        cached = None
+        while True:
+            midnight = day.toordinal() * 1440 - origin
+            if midnight >= self.minutes:
+                return
+            if cached != (day.year, day.month):
+                cached = day.year, day.month
+                valid_days = 0
+                if spec.month_mask >> day.month & 1:
+                    valid_days = spec.valid_days(day.year, day.month)
+            if valid_days >> day.day & 1:
+                for time in times:
+                    if 0 <= midnight + time < self.minutes:
+                        yield midnight + time
+            day += timedelta(days=1)
+
+    def peaks(self, top=10):
+        # List top (date, runs) minutes of each queue, by queue name. Ties are
+        # ordered by date. Minutes without runs are ignored.
+        tz = self.start.tzinfo
+        peaks = {}
+        for queue, histogram in sorted(self.histograms.items()):
+            busiest = heapq.nsmallest(top, (
+                (-runs, minute) for minute, runs in enumerate(histogram)
+                if runs))
+            peaks[queue] = [
+                (timestamp_to_date(self.first + minute * 60, tz), -runs)
+                for runs, minute in busiest]
+        return peaks
+
+    def total(self):
+        return sum(sum(histogram) for histogram in self.histograms.values())
+
+    def walk(self, spec, tz):
+        # Yield seconds since start of runs of spec, one by one.
+        timestamp = self.first - 1
+        while True:
+            timestamp = spec.next_timestamp(timestamp, tz)
+            if timestamp >= self.last:
+                return
+            yield timestamp - self.first
+
+    def write(self, out, top=10):
+        # Write top minutes of each queue as tab-separated lines: "peak QUEUE
+        # MINUTE RUNS".
+        for queue, peaks in self.peaks(top).items():
+            for date, runs in peaks:
+                out.write('peak\t%s\t%s\t%d\n' % (
+                    queue, date.isoformat(), runs))
+
+
+def lowest_set_bit(mask):
+    # Index of lowest set bit. -1 if mask is 0.
+    return (mask & -mask).bit_length() - 1
+
+
+def next_set_bit(mask, start, period):
+    # Return first set bit of mask at or after start. If there is none, wrap
+    # to next period. e.g. with valid minutes 25 and 50, next_set_bit from 55
+    # returns 60 + 25 = 85, timedelta will translate it to next hour.
+    upper = mask >> start << start
+    if upper:
+        return lowest_set_bit(upper)
+    return period + lowest_set_bit(mask)
+
+
+def main(broker, modules, path, verbose=1, send_workers=8,
+         ha=False, lease_ttl=10, shard=None, checkpoint=None, catch_up='none',
+         catch_up_limit=100, log_queue=False, metrics_port=None, spread=0,
+         schedules=None, watch=False, simulate=False, start=None, end=None,
+         profile=None, top=10):
+    # CLI and worker modules are imported lazily, keeping periodiq cheap to
+    # import for workers loading PeriodiqMiddleware.
+    import signal
+
+    from dramatiq.cli import import_broker
+
+    listener = setup_logging(verbose, log_queue)
+    try:
+        logger.info("Starting Periodiq, a simple scheduler for Dramatiq.")
+
+        for _path in path:
+            sys.path.insert(0, _path)
+        target = broker
+        _, broker = import_broker(target)
+        for module in modules:
+            importlib.import_module(module)
+
+        periodic_actors = collect_actors(broker, shard)
+        if shard is not None:
+            logger.info("Scheduling shard %s/%s.", *shard)
+            if shard[0] and schedules:
+                # Dynamic schedules are not sharded. First shard sends them
+                # all.
+                logger.info("Dynamic schedules are sent by shard 0.")
+                schedules = None
+        if not periodic_actors and not schedules:
+            logger.error("No periodic actor to schedule.")
+            return 1
+        print_periodic_actors(periodic_actors)
+
+        if profile:
+            # Count runs per minute of next day or week from specs, without
+            # scheduling.
+            start = start or pendulum.today()
+            began = monotonic()
+            load = LoadProfile(
+                periodic_actors, start, days=7 if 'week' == profile else 1,
+                spread=spread)
+            logger.info(
+                "Profiled %s runs over a %s from %s in %.1fs.",
+                load.total(), profile, start, monotonic() - began)
+            load.write(sys.stdout, top=top)
+            return 0
+
+        if simulate:
+            # Dry run, neither sending messages nor reading dynamic schedules.
+            start = start or pendulum.now()
+            end = end or start.add(days=1)
+            simulation = Simulation(periodic_actors, start, end, spread=spread)
+            began = monotonic()
+            simulation.loop()
+            logger.info(
+                "Simulated %s runs from %s to %s in %.1fs.",
+                len(simulation.runs), start, end, monotonic() - began)
+            simulation.write(sys.stdout)
+            return 0
+
+        lease = make_lease(broker, ttl=lease_ttl, shard=shard) if ha else None
+        metrics = None
+        if metrics_port is not None:
+            metrics = Metrics()
+            serve_metrics(metrics, metrics_port)
+            logger.info("Serving metrics on port %s.", metrics_port)
+        scheduler = Scheduler(
+            actors=periodic_actors, send_workers=send_workers, lease=lease,
+            checkpoint=FileCheckpoint(checkpoint) if checkpoint else None,
+            catch_up=catch_up, catch_up_limit=catch_up_limit,
+            metrics=metrics, spread=spread,
+            schedules=make_schedules(broker, schedules) if schedules else None,
+            broker=broker,
+        )
+
+        def collect():
+            # Broker module may declare a new broker on reload.
+            _, broker = import_broker(target)
+            return broker, collect_actors(broker, shard)
+
+        # Reload actors on SIGHUP, or when a module changes with watch.
+        reloader = Reloader(
+            scheduler, [target.partition(':')[0]] + list(modules), collect,
+            interval=1. if watch else None)
+        reloader.start()
+        if hasattr(signal, 'SIGHUP') and \
+                threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda *_: reloader.request())
+        scheduler.loop()
+        reloader.stop()
+
+        return 0
+    finally:
+        if listener is not None:
+            listener.stop()
 
 
 def make_argument_parser():
-    dist = get_distribution('periodiq')
+    import argparse
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python < 3.8
+        from pkg_resources import get_distribution
+
+        def version(name):
+            return get_distribution(name).version
+
     parser = argparse.ArgumentParser(
         prog="periodiq",
         description="Run periodiq scheduler.",
@@ -342,7 +1037,87 @@ def make_argument_parser():
         help="the module import path (default: %(default)s)",
     )
 
-    parser.add_argument("--version", action="version", version=dist.version)
+    parser.add_argument(
+        "--ha", default=False, action="store_true",
+        help="elect a single leader among several periodiq instances",
+    )
+    parser.add_argument(
+        "--lease-ttl", default=10, type=float,
+        help="seconds before leader lease expires (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--shard", default=None, type=parse_shard, metavar="i/N",
+        help="schedule only actors of shard i out of N, 0 <= i < N",
+    )
+
+    parser.add_argument(
+        "--checkpoint", default=None, metavar="PATH",
+        help="file to persist last run of each actor",
+    )
+    parser.add_argument(
+        "--catch-up", default="none", choices=["none", "latest", "all"],
+        help="runs to send if missed since checkpoint (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--catch-up-limit", default=100, type=int, metavar="N",
+        help="with --catch-up=all, maximum runs per actor "
+        "(default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--schedules", default=None, metavar="PATH",
+        help="send dynamic schedules stored in SQLite database PATH, or in "
+        "broker Redis with 'redis'",
+    )
+
+    parser.add_argument(
+        "--spread", default=0, type=float, metavar="SECONDS",
+        help="spread runs of each date over SECONDS, by actor name "
+        "(default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--simulate", default=False, action="store_true",
+        help="print runs and load per minute between --from and --to "
+        "without sending messages",
+    )
+    parser.add_argument(
+        "--profile", default=None, choices=["day", "week"],
+        help="print minutes with most runs by queue over a day or a week "
+        "from --from, computed from specs",
+    )
+    parser.add_argument(
+        "--top", default=10, type=int, metavar="N",
+        help="with --profile, minutes to print per queue "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--from", dest="start", default=None, type=parse_date, metavar="DATE",
+        help="start date of simulation (default: now) or profile (default: "
+        "today)",
+    )
+    parser.add_argument(
+        "--to", dest="end", default=None, type=parse_date, metavar="DATE",
+        help="end date of simulation (default: one day after start)",
+    )
+
+    parser.add_argument(
+        "--watch", default=False, action="store_true",
+        help="reload actors when a module file changes, as on SIGHUP",
+    )
+
+    parser.add_argument(
+        "--metrics-port", default=None, type=int, metavar="PORT",
+        help="serve Prometheus metrics on localhost:PORT",
+    )
+    parser.add_argument(
+        "--log-queue", default=False, action="store_true",
+        help="write logs from a background thread",
+    )
+
+    parser.add_argument(
+        "--version", action="version", version=version('periodiq'))
     parser.add_argument(
         "--verbose", "-v", default=0, action="count",
         help="turn on verbose log output",
@@ -351,100 +1126,1345 @@ def make_argument_parser():
     return parser
 
 
+def make_lease(broker, ttl, shard=None):
+    # Elect leader through broker backend. Each shard elects its own leader.
+    if hasattr(broker, 'client'):
+        # RedisBroker.
+        key = 'periodiq-leader'
+        if shard is not None:
+            key += ':%s/%s' % shard
+        return RedisLease(broker.client, key=key, ttl=ttl)
+    raise ValueError("HA mode requires a Redis broker.")
+
+
+def make_schedules(broker, url):
+    # Dynamic schedules store from --schedules argument: redis to use broker
+    # Redis, or path to a SQLite database.
+    if 'redis' == url:
+        if not hasattr(broker, 'client'):
+            raise ValueError("Redis schedules require a Redis broker.")
+        return RedisSchedules(broker.client)
+    return SQLiteSchedules(url)
+
+
+class Metrics:
+    # Scheduler and middleware instrumentation, rendered in Prometheus text
+    # exposition format. Thread-safe. Samples are keyed by sorted labels.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help text, buckets, {labels: sample})
+        self.metrics = collections.OrderedDict()
+        self.declare(
+            'periodiq_wakeup_drift_seconds', 'histogram',
+            "Delay between scheduled date and actual wake up.",
+            buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 5),
+        )
+        self.declare(
+            'periodiq_enqueue_seconds', 'histogram',
+            "Time to enqueue a message, by actor.",
+            buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1),
+        )
+        self.declare(
+            'periodiq_tick_actors', 'histogram',
+            "Actors sent per tick.",
+            buckets=(1, 10, 100, 1000, 10000),
+        )
+        self.declare(
+            'periodiq_skipped_messages_total', 'counter',
+            "Messages skipped by workers for exceeding skip_delay.",
+        )
+
+    def declare(self, name, type_, text, buckets=()):
+        self.metrics[name] = type_, text, tuple(buckets), {}
+
+    def inc(self, name, value=1, **labels):
+        samples = self.metrics[name][3]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        _, _, buckets, samples = self.metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            sample = samples.get(key)
+            if sample is None:
+                # Count per bucket, then +Inf bucket, then sum.
+                sample = samples[key] = [0] * (len(buckets) + 2)
+            sample[bisect.bisect_left(buckets, value)] += 1
+            sample[-1] += value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (type_, text, buckets, samples) in self.metrics.items():
+                lines.append('# HELP %s %s' % (name, text))
+                lines.append('# TYPE %s %s' % (name, type_))
+                for labels, sample in samples.items():
+                    if 'counter' == type_:
+                        lines.append('%s%s %s' % (
+                            name, format_labels(labels), sample))
+                        continue
+
+                    count = 0
+                    for bound, hits in zip(buckets + ('+Inf',), sample):
+                        count += hits
+                        lines.append('%s_bucket%s %s' % (
+                            name, format_labels(labels + (('le', bound),)),
+                            count))
+                    lines.append('%s_sum%s %s' % (
+                        name, format_labels(labels), sample[-1]))
+                    lines.append('%s_count%s %s' % (
+                        name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def ordinal_minutes(year, month, day, hour, minute):
+    # Minutes since 0001-01-01T00:00, in wall-clock time.
+    return (date(year, month, day).toordinal() * 24 + hour) * 60 + minute
+
+
+def parse_date(value):
+    # Parse --from and --to dates, in local timezone unless specified.
+    from argparse import ArgumentTypeError
+
+    try:
+        return pendulum.parse(value, tz=pendulum.local_timezone())
+    except ValueError:
+        raise ArgumentTypeError("Invalid date %r." % value)
+
+
+def parse_shard(value):
+    # Parse i/N shard argument.
+    from argparse import ArgumentTypeError
+
+    index, _, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ArgumentTypeError("Shard must be i/N.")
+    if not 0 <= index < count:
+        raise ArgumentTypeError("Shard must be 0 <= i < N.")
+    return index, count
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
 def print_periodic_actors(actors):
-    stdout.write("Registered periodic actors:")
-    stdout.write("")
-    stdout.write("    %-24s module:actor@queue" % ('m h dom mon dow',))
-    stdout.write("    %-24s ------------------" % ('-' * 24, ))
+    logger.info("Registered periodic actors:")
+    logger.info("")
+    logger.info("    %-24s module:actor@queue", 'm h dom mon dow')
+    logger.info("    %-24s ------------------", '-' * 24)
     for actor in actors:
         kw = dict(
             module=actor.fn.__module__,
             name=actor.actor_name,
             queue=actor.queue_name,
             spec=str(actor.options['periodic']),
+            tz=actor.options['periodic'].tz or '',
         )
-        stdout.write("    %(spec)-24s %(module)s:%(name)s@%(queue)s " % kw)
-    stdout.write("")
+        logger.info(
+            "    %(spec)-24s %(module)s:%(name)s@%(queue)s %(tz)s", kw)
+    logger.info("")
 
 
 class PeriodiqMiddleware(Middleware):
-    actor_options = set(['periodic'])
+    actor_options = set([
+        'periodic', 'periodic_coalesce', 'periodic_max_instances',
+        'periodic_spread',
+    ])
 
-    def __init__(self, skip_delay=30):
+    def __init__(self, skip_delay=30, dedupe=None, dedupe_ttl=86400,
+                 metrics=None, inflight=None, inflight_ttl=3600):
         self.skip_delay = skip_delay
+        # Store of periodiq_key already processed, e.g. RedisStore. Ensure a
+        # run is processed once, even if sent twice.
+        self.dedupe = dedupe
+        self.dedupe_ttl = dedupe_ttl
+        # Metrics instance counting skipped messages, see serve_metrics().
+        # Without it, workers count them with dramatiq Prometheus middleware,
+        # if any. See after_process_boot().
+        self.metrics = metrics
+        self.skipped = None
+        # Store of runs queued or running, shared with scheduler, for actors
+        # with periodic_max_instances. Scheduler holds a slot per run sent,
+        # workers release it once processed or skipped. Slots of lost
+        # messages expire after inflight_ttl seconds.
+        self.inflight = inflight
+        self.inflight_ttl = inflight_ttl
+
+    def after_ack(self, broker, message):
+        # Message is done, processed or skipped. Unless it failed and Retries
+        # enqueued it again, or it only moved from the delay queue to its
+        # queue: the retry keeps the slot of the run.
+        if 'eta' in message.options:
+            return
+        if getattr(message, '_exception', None) is not None and any(
+                isinstance(m, Retries) for m in broker.middleware):
+            return
+        self.release(broker, message)
+
+    def after_nack(self, broker, message):
+        # Failed for good.
+        self.release(broker, message)
+
+    def after_process_boot(self, broker):
+        # Worker processes each serving Metrics would compete for a single
+        # port. Count skipped messages in prometheus_client multiprocess
+        # files instead, exposed by dramatiq Prometheus middleware for all
+        # processes. Like this middleware, enable multiprocess mode before
+        # importing prometheus_client.
+        prometheus = sys.modules.get('dramatiq.middleware.prometheus')
+        if self.metrics is not None or prometheus is None or not any(
+                isinstance(m, prometheus.Prometheus)
+                for m in broker.middleware):
+            return
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = prometheus.DB_PATH
+        os.environ['prometheus_multiproc_dir'] = prometheus.DB_PATH
+        import prometheus_client
+
+        self.skipped = prometheus_client.Counter(
+            'periodiq_skipped_messages_total',
+            "Messages skipped by workers for exceeding skip_delay.",
+            ['actor'], registry=prometheus_client.CollectorRegistry())
 
     def before_process_message(self, broker, message):
-        actor = broker.actors[message.actor_name]
-        if 'periodic' not in actor.options:
+        # Runs for every message processed by workers. Keep it cheap: compare
+        # epoch milliseconds without building dates or strings.
+        if 'periodic' not in broker.actors[message.actor_name].options:
             return
 
-        msg_str = '%s:%s' % (message.message_id, message)
-        if 'scheduled_at' not in message.options:
-            stdout.write("%s looks manually triggered.", msg_str)
+        options = message.options
+        scheduled_at = options.get('scheduled_at')
+        if scheduled_at is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "%s:%s looks manually triggered.",
+                    message.message_id, message,
+                    extra=dict(actor=message.actor_name,
+                               message_id=message.message_id))
             return
 
-        now = pendulum.now()
-        scheduled_at = pendulum.parse(message.options['scheduled_at'])
-        delta = now - scheduled_at
-
-        if delta.total_seconds() > self.skip_delay:
-            stdout.write("Skipping %s older than %ss", msg_str, self.skip_delay)
-            raise SkipMessage()
+        if isinstance(scheduled_at, str):
+            # ISO 8601 date sent by previous periodiq versions.
+            delay = (
+                pendulum.now() - pendulum.parse(scheduled_at)).total_seconds()
         else:
-            stdout.write(
-                "Processing %s scheduled at %s.",
-                msg_str, message.options['scheduled_at'])
+            delay = time() - scheduled_at / 1000.
+
+        # Missed runs sent by catch-up are late by design.
+        if delay > self.skip_delay and not options.get('periodiq_backfill'):
+            logger.warning(
+                "Skipping %s:%s older than %ss.",
+                message.message_id, message, self.skip_delay,
+                extra=dict(actor=message.actor_name,
+                           message_id=message.message_id, delay=delay))
+            if self.metrics is not None:
+                self.metrics.inc(
+                    'periodiq_skipped_messages_total',
+                    actor=message.actor_name)
+            elif self.skipped is not None:
+                self.skipped.labels(message.actor_name).inc()
+            raise SkipMessage()
+
+        # Retries re-enqueue the same message, with the key already claimed
+        # by the failed attempt.
+        key = options.get('periodiq_key')
+        if self.dedupe is not None and key is not None and \
+                not options.get('retries'):
+            if not self.dedupe.add(key, self.dedupe_ttl):
+                logger.info(
+                    "Skipping %s:%s already processed.",
+                    message.message_id, message,
+                    extra=dict(actor=message.actor_name,
+                               message_id=message.message_id, key=key))
+                raise SkipMessage()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Processing %s:%s scheduled at %s.",
+                message.message_id, message, scheduled_at,
+                extra=dict(actor=message.actor_name,
+                           message_id=message.message_id, delay=delay))
+
+    def release(self, broker, message):
+        # Free slot of run, if actor limits its instances.
+        if self.inflight is None:
+            return
+        key = message.options.get('periodiq_key')
+        options = broker.actors[message.actor_name].options
+        if key is not None and options.get('periodic_max_instances'):
+            self.inflight.release('inflight:' + message.actor_name, key)
+
+
+class RedisLease:
+    # Lease stored in a Redis key. Acquired with SET NX PX, renewed and
+    # released only by holder. Lease expires after ttl seconds if holder
+    # crashes.
+
+    def __init__(self, client, key='periodiq-leader', ttl=10, token=None):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.token = token or uuid.uuid4().hex
+
+    def acquire(self):
+        # Acquire or renew lease. Returns whether we hold the lease.
+        ttl_ms = int(self.ttl * 1000)
+        if self.client.set(self.key, self.token, nx=True, px=ttl_ms):
+            return True
+        return self.if_holder(lambda pipe: pipe.pexpire(self.key, ttl_ms))
+
+    def if_holder(self, command):
+        # Run command in a transaction if we hold the lease. WATCH ensures
+        # lease did not change hands in between.
+        from redis.exceptions import WatchError
+
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                if pipe.get(self.key) not in (self.token, self.token.encode()):
+                    return False
+                pipe.multi()
+                command(pipe)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def release(self):
+        self.if_holder(lambda pipe: pipe.delete(self.key))
+
+
+class RedisSchedules:
+    # Dynamic schedules in Redis. A hash stores schedules by id, a sorted set
+    # indexes ids by next fire timestamp. See SQLiteSchedules for API.
+
+    def __init__(self, client, prefix='periodiq:'):
+        self.client = client
+        self.hash = prefix + 'schedules'
+        self.index = prefix + 'next_fire'
+
+    def add(self, schedule_id, actor_name, spec, args=(), kwargs=None,
+            tz=None, now=None):
+        spec = load_spec(str(spec), tz)
+        next_fire = spec.next_valid_date(now or pendulum.now()).timestamp()
+        row = json.dumps(dict(
+            actor_name=actor_name, spec=str(spec), tz=tz, args=list(args),
+            kwargs=kwargs or {},
+        ))
+        pipe = self.client.pipeline()
+        pipe.hset(self.hash, schedule_id, row)
+        pipe.zadd(self.index, {schedule_id: next_fire})
+        pipe.execute()
+
+    def next_fire(self):
+        first = self.client.zrange(self.index, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def pop_due(self, now, limit=1000):
+        # Reschedule in a transaction watching index. If another scheduler
+        # pops or reschedules meanwhile, retry from fresh index.
+        from redis.exceptions import WatchError
+
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.index)
+                    return self.pop_watched(pipe, now, limit)
+                except WatchError:
+                    continue
+
+    def pop_watched(self, pipe, now, limit):
+        timestamp = now.timestamp()
+        due = pipe.zrangebyscore(
+            self.index, '-inf', timestamp, start=0, num=limit,
+            withscores=True)
+        if not due:
+            pipe.unwatch()
+            return []
+        ids = [i for i, _ in due]
+        rows = pipe.hmget(self.hash, ids)
+        popped, next_fires = [], {}
+        pipe.multi()
+        for (schedule_id, fire), row in zip(due, rows):
+            if row is None:
+                # Removed since indexed.
+                pipe.zrem(self.index, schedule_id)
+                continue
+            row = json.loads(row)
+            spec = load_spec(row['spec'], row['tz'])
+            next_fires[schedule_id] = spec.next_valid_date(now).timestamp()
+            if isinstance(schedule_id, bytes):
+                schedule_id = schedule_id.decode('utf-8')
+            popped.append((
+                schedule_id, row['actor_name'], row['args'], row['kwargs'],
+                fire,
+            ))
+        if next_fires:
+            # Don't resurrect schedules removed meanwhile.
+            pipe.zadd(self.index, next_fires, xx=True)
+        pipe.execute()
+        return popped
+
+    def remove(self, schedule_id):
+        pipe = self.client.pipeline()
+        pipe.hdel(self.hash, schedule_id)
+        pipe.zrem(self.index, schedule_id)
+        pipe.execute()
+
+
+class RedisStore:
+    # Key store with expiration in Redis, shared by workers.
+
+    def __init__(self, client, prefix='periodiq:'):
+        self.client = client
+        self.prefix = prefix
+
+    def acquire(self, key, token, limit, ttl):
+        # Slots are members of a sorted set scored by expiration. WATCH
+        # retries if a worker releases a slot meanwhile.
+        from redis.exceptions import WatchError
+
+        key = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    now = time()
+                    if pipe.zcount(key, now, '+inf') >= limit:
+                        return False
+                    pipe.multi()
+                    pipe.zremrangebyscore(key, '-inf', now)
+                    pipe.zadd(key, {token: now + ttl})
+                    pipe.expire(key, int(ttl) + 1)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def add(self, key, ttl):
+        # Add key for ttl seconds unless present. Returns whether key was
+        # added.
+        key = self.prefix + key
+        return bool(self.client.set(key, 1, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key, token):
+        self.client.zrem(self.prefix + key, token)
+
+
+class Reloader:
+    # Re-import broker and actor modules from a background thread and hand
+    # new periodic actors to scheduler, so that imports never delay ticks.
+    # Reload on request(), e.g. on SIGHUP, or when a module file changes if
+    # interval is set.
+    def __init__(self, scheduler, modules, collect, interval=None):
+        self.scheduler = scheduler
+        self.modules = modules
+        # Callable returning (broker, periodic actors) after modules are
+        # reloaded.
+        self.collect = collect
+        self.interval = interval
+        self.mtimes = self.stat()
+        self.requested = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def reload(self):
+        # Re-import modules and send their actors to scheduler. On error,
+        # scheduler keeps current actors. Returns whether reload succeeded.
+        logger.info("Reloading %s.", ', '.join(self.modules))
+        self.mtimes = self.stat()
+        previous = registry = None
+        try:
+            # Dramatiq refuses to declare an actor twice. Re-import into a
+            # copy of broker registry without actors of reloaded modules, so
+            # that removed ones are gone too. Scheduler keeps looking actors
+            # up in former registry, never modified, until it applies reload.
+            previous, _ = self.collect()
+            registry = previous.actors
+            previous.actors = dict(
+                (name, a) for name, a in registry.items()
+                if getattr(a.fn, '__module__', None) not in self.modules)
+            for name in self.modules:
+                importlib.reload(sys.modules[name])
+            broker, actors = self.collect()
+        except Exception as e:
+            logger.exception("Failed to reload actors: %s.", e)
+            if registry is not None:
+                previous.actors = registry
+            return False
+
+        if broker is not previous:
+            # Broker module declared a new broker.
+            previous.actors = registry
+        print_periodic_actors(actors)
+        self.scheduler.reload(actors, broker)
+        return True
+
+    def request(self):
+        # Ask background thread to reload. Safe in a signal handler.
+        self.requested.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            if not self.requested.wait(self.interval):
+                if self.stat() == self.mtimes:
+                    continue
+            self.requested.clear()
+            if not self.stopping.is_set():
+                self.reload()
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name='periodiq-reload', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stat(self):
+        # Modification time of modules file, by module name.
+        mtimes = {}
+        for name in self.modules:
+            path = getattr(sys.modules.get(name), '__file__', None)
+            try:
+                mtimes[name] = os.stat(path).st_mtime
+            except (OSError, TypeError):
+                pass
+        return mtimes
+
+    def stop(self):
+        # Stop background thread, waiting for current reload.
+        self.stopping.set()
+        self.requested.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
 
 
 class Scheduler:
-    def __init__(self, actors):
+    def __init__(self, actors, send_workers=8, lease=None, checkpoint=None,
+                 catch_up='none', catch_up_limit=100, metrics=None, spread=0,
+                 schedules=None, broker=None, poll_interval=1., clock=None):
         self.actors = actors
-        # Q for communicating between main process and signal handler.
-        self.alarm_q = Queue()
+        # In HA mode, only the lease holder sends messages. Standby instances
+        # maintain the priority queue to take over at any time.
+        self.lease = lease
+        self.leader = lease is None
+        # Thread pool enqueuing messages concurrently. Created on first
+        # concurrent send.
+        self.send_workers = send_workers
+        self.executor = None
+        # Priority queue of (next timestamp, insertion order, next date,
+        # actor). Comparing timestamps is much cheaper than comparing dates
+        # of different timezones. Insertion order breaks ties so actors are
+        # never compared.
+        self.queue = []
+        self.counter = itertools.count()
+        # Live queue entry by actor name. Entries of removed or rescheduled
+        # actors stay in queue and are skipped when popped.
+        self.entries = {}
+        # Last fired date by actor name. Persisted in checkpoint to send runs
+        # missed while periodiq was down, according to catch_up policy:
+        # none, latest or all up to catch_up_limit runs per actor.
+        self.checkpoint = checkpoint
+        self.last_fired = checkpoint.load() if checkpoint else {}
+        self.catch_up = catch_up
+        self.catch_up_limit = catch_up_limit
+        # Set by stop() to interrupt loop. wakeup interrupts sleep on stop or
+        # reload.
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        # (actors, broker) pairs handed by reload(), applied on next tick.
+        self.pending = []
+        # Optional Metrics instance, see serve_metrics().
+        self.metrics = metrics
+        # Default window in seconds to spread runs over, overriden by
+        # periodic_spread actor option. Offsets are cached by actor name.
+        self.spread = spread
+        self.offsets = {}
+        # Store of dynamic schedules, e.g. SQLiteSchedules, targeting actors
+        # of broker. Polled every poll_interval seconds for new schedules.
+        self.schedules = schedules
+        self.broker = broker
+        self.poll_interval = poll_interval
+        # Optional VirtualClock replacing wall clock and sleep.
+        self.clock = clock
+        # Actors of broker by name, looked up by send_schedules(). Reloads
+        # re-import actors in a new registry and hand it over, this one is
+        # never modified under the scheduler thread.
+        self.registry = None if broker is None else broker.actors
+        # Store of runs in flight by broker, from its PeriodiqMiddleware.
+        self.inflight = {}
+        # Latest (date, actor) skipped by periodic_max_instances, by actor
+        # name, for actors with periodic_coalesce. Retried every
+        # poll_interval until a slot is free.
+        self.deferred = {}
+
+    def acquire(self, actor, key):
+        # Hold an in-flight slot for run key of actor, if actor sets
+        # periodic_max_instances. Returns False if as many runs are already
+        # queued or running, then run is skipped rather than piling up.
+        limit = actor.options.get('periodic_max_instances')
+        if not limit:
+            return True
+        broker = actor.broker
+        if broker not in self.inflight:
+            middleware = [
+                m for m in broker.middleware
+                if isinstance(m, PeriodiqMiddleware)]
+            self.inflight[broker] = middleware[0] if middleware else None
+            if not middleware or middleware[0].inflight is None:
+                logger.warning(
+                    "periodic_max_instances requires an inflight store in "
+                    "PeriodiqMiddleware. Ignoring.")
+        middleware = self.inflight[broker]
+        if middleware is None or middleware.inflight is None:
+            return True
+        if middleware.inflight.acquire(
+                'inflight:' + actor.actor_name, key, limit,
+                middleware.inflight_ttl):
+            return True
+        logger.info(
+            "Skipping %s, %s runs queued or running.", actor, limit,
+            extra=dict(actor=actor.actor_name))
+        return False
+
+    def coalesce(self, missed, due):
+        # Keep only the latest run of actors with periodic_coalesce, among
+        # missed runs sorted by date and runs due now. Skipped runs are
+        # coalesced by send_actors() and send_deferred().
+        seen = set(
+            actor.actor_name for _, actor in due
+            if actor.options.get('periodic_coalesce'))
+        kept = []
+        for date, actor in reversed(missed):
+            if actor.options.get('periodic_coalesce'):
+                if actor.actor_name in seen:
+                    continue
+                seen.add(actor.actor_name)
+            kept.append((date, actor))
+        kept.reverse()
+        return kept
+
+    def enqueue(self, broker, messages):
+        # Enqueue messages of one queue, recording latency of each actor.
+        start = monotonic()
+        enqueue_batch(broker, messages)
+        if self.metrics is not None:
+            elapsed = monotonic() - start
+            for message in messages:
+                self.metrics.observe(
+                    'periodiq_enqueue_seconds', elapsed,
+                    actor=message.actor_name)
+
+    def is_leader(self):
+        # Acquire or renew lease, logging changes of leadership.
+        if self.lease is None:
+            return True
+        leader = self.lease.acquire()
+        if leader and not self.leader:
+            logger.info("Acquired leadership.")
+        elif self.leader and not leader:
+            logger.warning("Lost leadership. Standing by.")
+        self.leader = leader
+        return leader
 
     def loop(self):
-        # Block until signal handler sends True.
-        while self.alarm_q.get(block=True):
-            self.schedule()
-
-    def send_actors(self, actors, now):
-        now_str = str(now)
+        # Iterate instead of recursing, late wake ups send immediately.
+        try:
+            while not self.stopping.is_set():
+                next_date = self.schedule()
+                self.sleep_until(next_date)
+        finally:
+            if self.lease is not None:
+                self.lease.release()
+
+    def missed(self, now):
+        # List (date, actor) missed since last fired date, according to
+        # catch-up policy. Sorted by date. Missed runs end where first
+        # pop_due() starts: one minute back, or one second back for
+        # sub-minute schedules, minus spread offset like push().
+        if 'none' == self.catch_up:
+            return []
+        limit = 1 if 'latest' == self.catch_up else self.catch_up_limit
+        ends = {
+            False: now - timedelta(minutes=1),
+            True: now - timedelta(seconds=1),
+        }
+        missed = []
+        for actor in self.actors:
+            last = self.last_fired.get(actor.actor_name)
+            if last is None:
+                continue
+            spec = actor.options['periodic']
+            end = ends[spec.has_seconds]
+            offset = self.offset(actor)
+            if offset:
+                end -= timedelta(seconds=offset)
+            dates = spec.iter_dates(last, end=end)
+            # Keep most recent runs, in constant memory.
+            missed.extend(
+                (d, actor) for d in collections.deque(dates, maxlen=limit))
+        missed.sort(key=lambda x: x[0].timestamp())
+        return missed
+
+    def next_wakeup(self, now=None):
+        # Date of next run, including spread offset. With dynamic schedules
+        # or deferred runs, wake up at most poll_interval seconds after now.
+        date = None
+        self.prune()
+        if self.queue:
+            _, _, date, actor = self.queue[0]
+            offset = self.offset(actor)
+            if offset:
+                date += timedelta(seconds=offset)
+        if self.schedules is None and not self.deferred:
+            return date
+
+        poll = (now or pendulum.now()).add(seconds=self.poll_interval)
+        next_fire = None
+        if self.schedules is not None:
+            next_fire = self.schedules.next_fire()
+        if next_fire is not None and next_fire < poll.timestamp():
+            poll = pendulum.from_timestamp(next_fire, tz=poll.timezone)
+        return poll if date is None or poll < date else date
+
+    def offset(self, actor):
+        # Deterministic delay of actor runs within its spread window, in
+        # seconds. Same actor always fires at the same offset, even across
+        # restarts and hosts.
+        offset = self.offsets.get(actor.actor_name)
+        if offset is None:
+            spread = actor.options.get('periodic_spread', self.spread)
+            offset = self.offsets[actor.actor_name] = spread_offset(
+                actor.actor_name, spread)
+        return offset
+
+    def pop_due(self, now):
+        # Pop (date, actor) due at now and push back their next date. Only due
+        # actors are recomputed, each wakeup costs O(k log N) for k due actors.
+        if not self.queue and self.actors:
+            # Start one minute back so that actors matching current minute
+            # are due right now. Sub-minute schedules start one second back.
+            coarse, fine = [], []
+            for actor in self.actors:
+                spec = actor.options['periodic']
+                (fine if spec.has_seconds else coarse).append(actor)
+            self.push(coarse, now - timedelta(minutes=1))
+            self.push(fine, now - timedelta(seconds=1))
+
+        due = []
+        timestamp = now.timestamp()
+        while self.queue and self.queue[0][0] <= timestamp:
+            entry = heapq.heappop(self.queue)
+            _, _, date, actor = entry
+            if self.entries.get(actor.actor_name) is entry:
+                due.append((date, actor))
+        self.push([actor for _, actor in due], now)
+        return due
+
+    def prune(self):
+        # Drop stale entries from the top of queue.
+        while self.queue:
+            entry = self.queue[0]
+            if self.entries.get(entry[3].actor_name) is entry:
+                break
+            heapq.heappop(self.queue)
+
+    def push(self, actors, last):
+        # Search next timestamps from last. Actors sharing a spec and an
+        # offset share their next date, searched once. Timezone conversion
+        # happens once per spec timezone.
+        #
+        # Spread actors are queued at their date plus offset. Their next date
+        # is searched from last minus offset, as if fired on time.
+        timestamp = datetime.timestamp(last)
+        zones = {}
+        found = {}
         for actor in actors:
-            stdout.write("Scheduling {} at {}.".format(actor, now_str))
-            actor.send_with_options(scheduled_at=now_str)
+            spec = actor.options['periodic']
+            offset = self.offset(actor)
+            key = id(spec), offset
+            fire = found.get(key)
+            if fire is None:
+                tz = zones.get(spec.tz)
+                if tz is None:
+                    tz = zones[spec.tz] = spec.localize(last).tzinfo
+                next_timestamp = spec.next_timestamp(timestamp - offset, tz)
+                fire = found[key] = (
+                    next_timestamp + offset,
+                    timestamp_to_date(next_timestamp, tz))
+            entry = fire[0], next(self.counter), fire[1], actor
+            heapq.heappush(self.queue, entry)
+            self.entries[actor.actor_name] = entry
+
+    def reload(self, actors, broker=None):
+        # Replace actors from another thread, e.g. after re-importing their
+        # modules. The scheduler thread applies them on its next tick, waking
+        # up now. Registry of broker is complete by now, keep it.
+        registry = None if broker is None else broker.actors
+        self.pending.append((actors, broker, registry))
+        self.wakeup.set()
+
+    def send_actors(self, actors, now, **options):
+        # Send actors scheduled at now. periodiq_key identifies the run, so
+        # that workers can ignore duplicates. scheduled_at includes spread
+        # offset, workers measure lateness from it. Runs over
+        # periodic_max_instances are skipped, yet recorded as fired. With
+        # periodic_coalesce, the latest skipped run is deferred instead.
+        timestamp = now.timestamp()
+        batches = collections.OrderedDict()
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for actor in actors:
+            self.last_fired[actor.actor_name] = now
+            periodiq_key = '%s@%d' % (actor.actor_name, timestamp)
+            if not self.acquire(actor, periodiq_key):
+                if actor.options.get('periodic_coalesce'):
+                    self.deferred[actor.actor_name] = now, actor
+                continue
+            if self.deferred:
+                # A newer run supersedes deferred one.
+                self.deferred.pop(actor.actor_name, None)
+            # Epoch milliseconds, cheap to compare in workers.
+            scheduled_at = int((timestamp + self.offset(actor)) * 1000)
+            if debug:
+                logger.debug(
+                    "Scheduling %s at %s.", actor, now,
+                    extra=dict(actor=actor.actor_name,
+                               scheduled_at=scheduled_at))
+            message = actor.message_with_options(
+                scheduled_at=scheduled_at, periodiq_key=periodiq_key,
+                **options)
+            key = actor.broker, message.queue_name
+            batches.setdefault(key, []).append(message)
+        self.send_batches(batches)
+
+    def send_batches(self, batches):
+        # Send lists of messages by (broker, queue name).
+        if sum(map(len, batches.values())) < 2 or self.send_workers < 2:
+            for (broker, _), messages in batches.items():
+                self.enqueue(broker, messages)
+            return
+
+        # Send concurrently to hide broker round-trip latency. A broker
+        # implementing enqueue_many() receives one batch per queue, e.g. to
+        # use a Redis pipeline. Other brokers enqueue one message per task.
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.send_workers)
+        futures = []
+        for (broker, _), messages in batches.items():
+            if hasattr(broker, 'enqueue_many'):
+                futures.append(
+                    self.executor.submit(self.enqueue, broker, messages))
+            else:
+                futures.extend(
+                    self.executor.submit(self.enqueue, broker, [m])
+                    for m in messages)
+        # Wait for all messages and raise first error, if any.
+        for future in futures:
+            future.result()
+
+    def send_deferred(self):
+        # Retry runs deferred by periodic_coalesce, as late by design. Runs
+        # still over limit are deferred again. Deferred runs are older than
+        # last fired dates, keep these.
+        deferred = [
+            (date, self.entries[name][3])
+            for name, (date, _) in self.deferred.items()
+            if name in self.entries]
+        self.deferred.clear()
+        deferred.sort(key=lambda x: x[0].timestamp())
+        last_fired = dict(
+            (actor.actor_name, self.last_fired.get(actor.actor_name))
+            for _, actor in deferred)
+        self.send_due(deferred, periodiq_backfill=True)
+        self.last_fired.update(last_fired)
+
+    def send_due(self, due, **options):
+        # Send (date, actor) pairs sorted by date, in bulk for each date.
+        # Same instant may come in several timezones, aware dates compare as
+        # absolute times. Dates of the same timezone compare as wall-clock
+        # time, fold tells repeated wall-clock time apart. Cheaper than
+        # computing timestamps.
+        groups = itertools.groupby(due, key=lambda x: (x[0], x[0].fold))
+        for _, pairs in groups:
+            pairs = list(pairs)
+            self.send_actors(
+                [actor for _, actor in pairs], now=pairs[0][0], **options)
+
+    def send_schedules(self, now, limit=1000):
+        # Send due dynamic schedules, reading at most limit rows at once.
+        # Cost depends on due schedules only, thanks to store index.
+        registry = self.registry
+        if registry is None:
+            registry = (self.broker or dramatiq.get_broker()).actors
+        while True:
+            rows = self.schedules.pop_due(now, limit=limit)
+            batches = collections.OrderedDict()
+            for schedule_id, actor_name, args, kwargs, fire in rows:
+                actor = registry.get(actor_name)
+                if actor is None:
+                    logger.warning(
+                        "Unknown actor %s for schedule %s.",
+                        actor_name, schedule_id,
+                        extra=dict(actor=actor_name))
+                    continue
+                message = actor.message_with_options(
+                    args=tuple(args), kwargs=kwargs,
+                    scheduled_at=int(fire * 1000),
+                    periodiq_key='%s@%d' % (schedule_id, fire))
+                key = actor.broker, message.queue_name
+                batches.setdefault(key, []).append(message)
+            if batches:
+                logger.debug(
+                    "Scheduling %s dynamic schedules.", len(rows),
+                    extra=dict(count=len(rows)))
+                self.send_batches(batches)
+            if len(rows) < limit:
+                break
 
     def schedule(self):
-        now = (pendulum.now() + timedelta(seconds=0.5)).replace(microsecond=0)
-        stdout.write("Wake up at {}.".format(now))
-        self.send_actors([
-            a for a in self.actors
-            if a.options['periodic'].validate(now)
-        ], now=now)
-
-        prioritized_actors = sorted([
-            (actor.options['periodic'].next_valid_date(now), actor)
-            for actor in self.actors
-        ], key=lambda x: x[0])  # Sort only on date.
-
-        next_date, _ = prioritized_actors[0]
-        stdout.write("Nothing to do until {}.".format(next_date))
-        # Refresh now because we may have spent some time sending messages.
-        delay = next_date - pendulum.now()
-        if delay.total_seconds() <= 0:
-            stdout.write("Negative delay. Scheduling immediately.")
-            return self.schedule()
-
-        delay_s = delay.total_seconds()
-        delay_s, delay_ms = int(delay_s), delay_s % 1
-        stdout.write("Sleeping for {} ({}).".format(delay_s, delay))
-        # Sleep microseconds because alarm only accepts integers.
-        sleep(delay_ms)
-        if delay_s:
-            alarm(delay_s)
-            signal(SIGALRM, self.signal_handler)
-        else:
-            self.alarm_q.put_nowait(True)
+        # Send due actors and return date of next wake up.
+        now = pendulum.now() if self.clock is None else self.clock.now()
+        logger.debug("Wake up at %s.", now)
+        self.tick(now)
+
+        next_date = self.next_wakeup(now)
+        logger.debug(
+            "Nothing to do until %s.", next_date,
+            extra=dict(next_date=next_date))
+        return next_date
+
+    def sleep_until(self, date):
+        # Translate date to a monotonic deadline once, so that wall clock
+        # adjustments don't affect sleep. Without date, e.g. when a reload
+        # removed all actors, sleep until next reload or stop. Returns True
+        # if stopped or reloaded.
+        if self.clock is not None:
+            # Virtual time, stop once clock reaches its end.
+            if not self.clock.sleep_until(date):
+                self.stop()
+            return self.stopping.is_set()
+
+        deadline = None
+        if date is not None:
+            delay = (date - pendulum.now()).total_seconds()
+            if delay > 0:
+                logger.debug("Sleeping for %ss.", delay)
+            deadline = monotonic() + delay
+        if self.lease is None:
+            return self.wait(deadline)
+
+        # Renew lease or try to take over several times per TTL. Failover
+        # happens at most ttl + ttl / 3 seconds after leader crash.
+        while True:
+            step = monotonic() + self.lease.ttl / 3.
+            if deadline is not None and deadline <= step:
+                return self.wait(deadline)
+            if self.wait(step):
+                return True
+            self.is_leader()
+
+    def stop(self):
+        # Stop loop from another thread or a signal handler.
+        self.stopping.set()
+        self.wakeup.set()
+
+    def tick(self, now):
+        # Send actors due at now. On first tick, send missed runs first.
+        first = not self.queue
+        due = self.pop_due(now)
+        # Apply reloaded actors after popping due ones, so that no run of
+        # current date is lost.
+        while self.pending:
+            actors, broker, registry = self.pending.pop(0)
+            self.update(actors, now, broker=broker)
+            if registry is not None:
+                self.registry = registry
+        if not self.is_leader():
+            logger.debug(
+                "Standby, skipping %s actors.", len(due),
+                extra=dict(count=len(due)))
+            return
+
+        if due and self.metrics is not None:
+            if not first:
+                # First tick sends actors due since start of minute.
+                date, actor = due[0]
+                self.metrics.observe(
+                    'periodiq_wakeup_drift_seconds',
+                    now.timestamp() - date.timestamp() - self.offset(actor))
+            self.metrics.observe('periodiq_tick_actors', len(due))
+
+        missed = self.missed(now) if first else []
+        missed = self.coalesce(missed, due)
+        if missed:
+            logger.info(
+                "Catching up %s missed runs.", len(missed),
+                extra=dict(count=len(missed)))
+            self.send_due(missed, periodiq_backfill=True)
+        self.send_due(due)
+        if self.deferred:
+            self.send_deferred()
+        if (missed or due) and self.checkpoint is not None:
+            self.checkpoint.save(self.last_fired)
+        if self.schedules is not None:
+            self.send_schedules(now)
+
+    def update(self, actors, now, broker=None):
+        # Diff actors against current ones by name and update queue in place,
+        # in O(k log N) for k changed actors. An actor declared again with
+        # the same schedule keeps its next date.
+        def timing(actor):
+            return actor.options['periodic'], actor.options.get(
+                'periodic_spread')
+
+        current = dict((a.actor_name, a) for a in self.actors)
+        rescheduled = []
+        for actor in actors:
+            previous = current.pop(actor.actor_name, None)
+            if previous is actor:
+                continue
+            entry = self.entries.get(actor.actor_name)
+            if entry is not None and timing(previous) == timing(actor):
+                # Swap actor, keeping date.
+                timestamp, _, date, _ = entry
+                entry = (timestamp, next(self.counter), date, actor)
+                heapq.heappush(self.queue, entry)
+                self.entries[actor.actor_name] = entry
+                continue
+            self.entries.pop(actor.actor_name, None)
+            self.offsets.pop(actor.actor_name, None)
+            rescheduled.append(actor)
+        for name in current:
+            self.entries.pop(name, None)
+            self.offsets.pop(name, None)
+        self.push(rescheduled, now)
+        self.actors = list(actors)
+        if broker is not None:
+            self.broker = broker
+
+        # Rebuild queue once mostly stale, bounding memory across reloads.
+        if len(self.queue) > 2 * len(self.entries):
+            self.queue = list(self.entries.values())
+            heapq.heapify(self.queue)
+        logger.info(
+            "Reloaded %s periodic actors: %s rescheduled, %s removed.",
+            len(self.actors), len(rescheduled), len(current),
+            extra=dict(count=len(self.actors)))
+
+    def wait(self, deadline):
+        # Block until monotonic deadline, forever if None. Event.wait() may
+        # return a bit early, loop until deadline is reached. Returns True if
+        # stopped or reloaded.
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+            if self.wakeup.wait(remaining):
+                if not self.stopping.is_set():
+                    self.wakeup.clear()
+                return True
+
+
+class AsyncScheduler(Scheduler):
+    # Run scheduler as a coroutine in an existing asyncio loop. Brokers are
+    # blocking, messages are sent from a thread to not block the loop. Cancel
+    # the task running run() to stop it.
+
+    # Running loop and event interrupting its sleep on reload, set by run().
+    loop = None
+    awake = None
+
+    def reload(self, actors, broker=None):
+        super().reload(actors, broker=broker)
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.awake.set)
+
+    async def run(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        self.awake = asyncio.Event()
+        self.loop = loop
+        try:
+            while True:
+                now = pendulum.now()
+                logger.debug("Wake up at %s.", now)
+                await loop.run_in_executor(None, self.tick, now)
+
+                next_date = self.next_wakeup(now)
+                logger.debug(
+                    "Nothing to do until %s.", next_date,
+                    extra=dict(next_date=next_date))
+                if next_date is None:
+                    # No actor left, e.g. after reload. Poll for a reload.
+                    delay = self.poll_interval
+                else:
+                    delay = (next_date - pendulum.now()).total_seconds()
+                if self.lease is not None:
+                    # Renew lease several times per TTL.
+                    delay = min(delay, self.lease.ttl / 3.)
+                try:
+                    await asyncio.wait_for(self.awake.wait(), max(0, delay))
+                except asyncio.TimeoutError:
+                    pass
+                self.awake.clear()
+        finally:
+            self.loop = None
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            if self.lease is not None:
+                self.lease.release()
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    # Expose metrics over HTTP from a daemon thread, for Prometheus to
+    # scrape. Returns the server, call shutdown() to stop it.
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header(
+                'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Don't write scrapes to stderr.
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name='periodiq-metrics', daemon=True)
+    thread.start()
+    return server
+
+
+def setup_logging(verbose, log_queue=False):
+    # Log periodiq records to stdout, unless application configured
+    # handlers, on periodiq logger or its ancestors, e.g. with
+    # logging.basicConfig(). With log_queue, a background thread writes
+    # records so that a slow stdout never delays ticks. Returns the
+    # QueueListener to stop.
+    #
+    # verbose counts -v flags: info by default, debug with -v.
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    if logger.hasHandlers():
+        return None
+
+    # Broker module may configure root logger afterwards. Don't print
+    # records twice.
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    if not log_queue:
+        logger.addHandler(handler)
+        return None
+
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    records = queue.Queue()
+    listener = QueueListener(records, handler)
+    listener.start()
+    logger.addHandler(QueueHandler(records))
+    return listener
+
+
+def shard_of(name, count):
+    # Assign name to a shard with consistent hashing: name belongs to the
+    # shard owning next point on the hash ring. Adding or removing a shard
+    # moves only about 1 / count of names.
+    points, shards = hash_ring(count)
+    i = bisect.bisect(points, stable_hash(name)) % len(points)
+    return shards[i]
+
+
+class Simulation(Scheduler):
+    # Fast-forward scheduler from start to end on a virtual clock, without
+    # sleeping. Runs are recorded as (timestamp, actor) pairs instead of
+    # being sent. Building messages would cost more than scheduling.
+    def __init__(self, actors, start, end, **kw):
+        super().__init__(
+            actors, clock=VirtualClock(start, end), **kw)
+        self.runs = []
+
+    def load(self):
+        # Count runs by minute timestamp.
+        return collections.Counter(
+            int(timestamp // 60 * 60) for timestamp, _ in self.runs)
+
+    def send_actors(self, actors, now, **options):
+        timestamp = now.timestamp()
+        for actor in actors:
+            self.runs.append((timestamp + self.offset(actor), actor))
+
+    def write(self, out):
+        # Write runs, then runs per minute, as tab-separated lines:
+        # "run DATE ACTOR" and "load MINUTE COUNT". Dates are in timezone of
+        # start.
+        tz = self.clock.start.tzinfo
+        dates = {}
+
+        def format_date(timestamp):
+            date = dates.get(timestamp)
+            if date is None:
+                date = dates[timestamp] = timestamp_to_date(
+                    timestamp, tz).isoformat()
+            return date
+
+        for timestamp, actor in self.runs:
+            out.write('run\t%s\t%s\n' % (
+                format_date(timestamp), actor.actor_name))
+        for minute, count in sorted(self.load().items()):
+            out.write('load\t%s\t%d\n' % (format_date(minute), count))
+
+
+def spread_offset(name, spread):
+    # Delay in seconds of runs of actor name within a spread window.
+    if not spread:
+        return 0
+    window = int(spread * 1000)
+    return stable_hash(name) % window / 1000.
+
+
+class SQLiteSchedules:
+    # Dynamic schedules in a SQLite table, indexed by next fire timestamp.
+    # Each schedule sends actor_name with args and kwargs according to spec.
+    # pop_due() returns (schedule_id, actor_name, args, kwargs, timestamp)
+    # of due schedules and reschedules them after now.
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS periodiq_schedule ("
+                "id TEXT PRIMARY KEY, actor_name TEXT NOT NULL, "
+                "spec TEXT NOT NULL, tz TEXT, args TEXT NOT NULL, "
+                "kwargs TEXT NOT NULL, next_fire REAL NOT NULL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS periodiq_schedule_next_fire "
+                "ON periodiq_schedule (next_fire)")
+
+    def add(self, schedule_id, actor_name, spec, args=(), kwargs=None,
+            tz=None, now=None):
+        # Create or replace schedule. spec is a CronSpec, an Interval or
+        # their string.
+        spec = load_spec(str(spec), tz)
+        next_fire = spec.next_valid_date(now or pendulum.now()).timestamp()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO periodiq_schedule "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                    schedule_id, actor_name, str(spec), tz,
+                    json.dumps(list(args)), json.dumps(kwargs or {}),
+                    next_fire,
+                ))
+
+    def next_fire(self):
+        # Timestamp of next due schedule, None if empty.
+        with self.lock:
+            return self.db.execute(
+                "SELECT MIN(next_fire) FROM periodiq_schedule").fetchone()[0]
+
+    def pop_due(self, now, limit=1000):
+        # Take write lock before reading, so that two schedulers sharing the
+        # database never pop the same rows.
+        with self.lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            rows = self.db.execute(
+                "SELECT id, actor_name, spec, tz, args, kwargs, next_fire "
+                "FROM periodiq_schedule WHERE next_fire <= ? "
+                "ORDER BY next_fire LIMIT ?", (now.timestamp(), limit),
+            ).fetchall()
+            popped, updates = [], []
+            for schedule_id, actor_name, spec, tz, args, kwargs, fire in rows:
+                spec = load_spec(spec, tz)
+                updates.append(
+                    (spec.next_valid_date(now).timestamp(), schedule_id))
+                popped.append((
+                    schedule_id, actor_name, json.loads(args),
+                    json.loads(kwargs), fire,
+                ))
+            self.db.executemany(
+                "UPDATE periodiq_schedule SET next_fire = ? WHERE id = ?",
+                updates)
+        return popped
+
+    def remove(self, schedule_id):
+        with self.lock, self.db:
+            self.db.execute(
+                "DELETE FROM periodiq_schedule WHERE id = ?", (schedule_id,))
+
+
+def stable_hash(value):
+    # Hash stable across processes, unlike hash().
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def timestamp_to_date(timestamp, tz):
+    # Same as pendulum.from_timestamp(), without its costly conversions.
+    local = datetime.fromtimestamp(timestamp, tz)
+    return pendulum.DateTime(
+        local.year, local.month, local.day, local.hour, local.minute,
+        local.second, local.microsecond, tzinfo=tz, fold=local.fold)
+
+
+def to_mask(values):
+    # Compile a list of valid values as a bitmask.
+    mask = 0
+    for x in values:
+        mask |= 1 << x
+    return mask
+
+
+class VirtualClock:
+    # Simulated time from start to end. Sleeping jumps to wake up date at
+    # once.
+    def __init__(self, start, end):
+        self.start = start
+        self.date = start
+        self.end = end
+
+    def now(self):
+        return self.date
+
+    def sleep_until(self, date):
+        # Returns False once date is past end. Compare timestamps, as dates
+        # of the same timezone ignore fold of repeated wall-clock time.
+        if date is None or date.timestamp() > self.end.timestamp():
+            return False
+        if date.timestamp() > self.date.timestamp():
+            self.date = date
+        return True
+
 
-    def signal_handler(self, *_):
-        stdout.write("Alaaaaarm!")
-        self.alarm_q.put_nowait(True)
+def wall_to_timestamp(timestamp, origin, wall, tz):
+    # Translate wall-clock (year, month, day, hour, minute) to a timestamp,
+    # relative to timestamp at origin ordinal minutes in tz. Returns None if
+    # wall-clock time does not exist in tz.
+    target = ordinal_minutes(*wall)
+    # Absolute add. If a DST change occurs in between, wall-clock shifts by
+    # the offset change. Compensate it.
+    timestamp += (target - origin) * 60
+    n = datetime.fromtimestamp(timestamp, tz)
+    shift = target - ordinal_minutes(n.year, n.month, n.day, n.hour, n.minute)
+    if shift:
+        timestamp += shift * 60
+        n = datetime.fromtimestamp(timestamp, tz)
+    if (n.year, n.month, n.day, n.hour, n.minute) == wall:
+        return timestamp
@@ -0,0 +1,56 @@
+# Evaluate thousands of specs over 90 days of minutes with CronArray. Run with:
+# python tests/bench/bench_array.py [specs] [days]
+
+import random
+import sys
+from time import perf_counter
+
+import numpy
+
+from periodiq import CronArray, cron
+
+
+def make_specs(count):
+    rand = random.Random(count)
+    templates = [
+        '* * * * *', '*/5 * * * *', '%(m)d * * * *', '%(m)d %(h)d * * *',
+        '%(m)d %(h)d * * %(dow)d', '%(m)d %(h)d %(dom)d * *',
+    ]
+    return [
+        cron(rand.choice(templates) % dict(
+            m=rand.randrange(60), h=rand.randrange(24),
+            dom=rand.randint(1, 28), dow=rand.randrange(7),
+        ))
+        for _ in range(count)
+    ]
+
+
+def main(count=5000, days=90):
+    specs = make_specs(count)
+    start = numpy.datetime64('2019-01-01T00:00')
+    times = numpy.arange(start, start + days * 1440, dtype='datetime64[m]')
+
+    t0 = perf_counter()
+    array = CronArray(specs)
+    compile_s = perf_counter() - t0
+
+    t0 = perf_counter()
+    indexes, _ = array.pairs(times)
+    pairs_s = perf_counter() - t0
+
+    # Sample validate() to extrapolate the cost of the naive loop.
+    sample = times[:1440].tolist()
+    t0 = perf_counter()
+    for spec in specs[:100]:
+        for date in sample:
+            spec.validate(date)
+    naive_s = (perf_counter() - t0) / (100 * 1440) * count * len(times)
+
+    print("%d specs x %d minutes" % (count, len(times)))
+    print("compile:          %8.3fs" % compile_s)
+    print("pairs:            %8.3fs (%d matches)" % (pairs_s, len(indexes)))
+    print("validate() loop: ~%8.0fs (extrapolated)" % naive_s)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,66 @@
+# Measure how late sub-minute schedules are enqueued by a running Scheduler.
+# Run with: python tests/bench/bench_drift.py [seconds] [actors]
+#
+# Exits with 1 if p99 drift exceeds 50ms.
+
+import sys
+import threading
+from time import sleep, time
+
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+import periodiq
+from periodiq import PeriodiqMiddleware, Scheduler, cron, every
+
+
+class RecordingBroker(StubBroker):
+    def __init__(self):
+        super().__init__()
+        self.drifts = []
+
+    def enqueue(self, message, *, delay=None):
+        scheduled_at = message.options['scheduled_at'] / 1000.
+        self.drifts.append((time() - scheduled_at) * 1000)
+        return super().enqueue(message, delay=delay)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(duration=10, count=100):
+    periodiq.logger.disabled = True
+    broker = RecordingBroker()
+    broker.add_middleware(PeriodiqMiddleware())
+
+    def noop():
+        pass
+
+    specs = [every(seconds=1), every(seconds=2), cron('*/5 * * * * *')]
+    actors = [
+        actor(
+            noop, broker=broker, actor_name='actor%d' % i,
+            periodic=specs[i % len(specs)])
+        for i in range(count)
+    ]
+    scheduler = Scheduler(actors=actors)
+    thread = threading.Thread(target=scheduler.loop)
+    thread.start()
+    sleep(duration)
+    scheduler.stop()
+    thread.join()
+
+    # Ignore first tick, sending actors due since last second.
+    drifts = sorted(broker.drifts[count:])
+    print("%d messages from %d actors in %ss, drift in ms:" % (
+        len(drifts), count, duration))
+    print("mean %.3f  p50 %.3f  p99 %.3f  max %.3f" % (
+        sum(drifts) / len(drifts), percentile(drifts, .5),
+        percentile(drifts, .99), drifts[-1],
+    ))
+    return 1 if percentile(drifts, .99) > 50 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
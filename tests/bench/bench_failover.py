@@ -0,0 +1,54 @@
+# Measure HA failover latency: time between leader crash and standby taking
+# over the lease. Run with: python tests/bench/bench_failover.py [ttl] [runs]
+
+import logging
+import sys
+import threading
+from time import monotonic, sleep
+
+import periodiq
+from periodiq import LocalLease, Scheduler
+
+
+class FakeActor:
+    actor_name = 'fake'
+    options = dict(periodic=periodiq.cron('0 0 1 1 *'))
+
+
+def failover(ttl):
+    key = 'bench-%s' % monotonic()
+    leader = Scheduler([FakeActor()], lease=LocalLease(key=key, ttl=ttl))
+    standby = Scheduler([FakeActor()], lease=LocalLease(key=key, ttl=ttl))
+    # Crash: leader stops renewing and never releases its lease.
+    leader.lease.release = lambda: None
+
+    threads = [
+        threading.Thread(target=s.loop) for s in (leader, standby)]
+    threads[0].start()
+    sleep(.05)
+    threads[1].start()
+    sleep(ttl / 2.)
+    assert leader.leader and not standby.leader
+
+    crashed_at = monotonic()
+    leader.stop()
+    while not standby.leader:
+        sleep(.001)
+    latency = monotonic() - crashed_at
+
+    standby.stop()
+    for thread in threads:
+        thread.join()
+    return latency
+
+
+def main(ttl=1., runs=5):
+    periodiq.logger.setLevel(logging.WARNING)
+    latencies = [failover(ttl) for _ in range(int(runs))]
+    print("ttl %.1fs, failover in s: min %.3f  mean %.3f  max %.3f" % (
+        ttl, min(latencies), sum(latencies) / len(latencies), max(latencies),
+    ))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
@@ -0,0 +1,42 @@
+# Measure periodiq import time with python -X importtime, as paid by every
+# dramatiq worker loading PeriodiqMiddleware. Run with:
+# python tests/bench/bench_import.py [runs] [max_ms]
+#
+# Exits with 1 if best cumulative import time exceeds max_ms.
+
+import subprocess
+import sys
+
+
+def importtime():
+    # Returns {module: (self_us, cumulative_us)} of a fresh interpreter.
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import periodiq'],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines()[1:]:
+        self_us, cumulative, name = line.split(':', 1)[1].split('|')
+        times[name.strip()] = int(self_us), int(cumulative)
+    return times
+
+
+def main(runs=5, max_ms=None):
+    results = [importtime() for _ in range(int(runs))]
+    best = min(results, key=lambda times: times['periodiq'][1])
+    total = best['periodiq'][1] / 1000.
+    print("periodiq: %.1f ms (best of %s)" % (total, runs))
+    print()
+    print("%10s  %s" % ('cumul (ms)', 'module'))
+    top = sorted(best.items(), key=lambda item: -item[1][1])[1:11]
+    for name, (_, cumulative) in top:
+        print("%10.1f  %s" % (cumulative / 1000., name))
+
+    if max_ms is not None and total > float(max_ms):
+        print("Import time exceeds %sms." % max_ms)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,32 @@
+# Measure how far Scheduler wake ups drift from their target. Run with:
+# python tests/bench/bench_jitter.py [samples]
+
+import random
+import sys
+from time import monotonic
+
+from periodiq import Scheduler
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(samples=500):
+    scheduler = Scheduler(actors=[])
+    rand = random.Random(0)
+    drifts = []
+    for _ in range(samples):
+        deadline = monotonic() + rand.uniform(.001, .02)
+        scheduler.wait(deadline)
+        drifts.append((monotonic() - deadline) * 1000)
+    drifts.sort()
+    print("%d wake ups, drift in ms:" % samples)
+    print("mean %.3f  p50 %.3f  p99 %.3f  max %.3f" % (
+        sum(drifts) / samples, percentile(drifts, .5),
+        percentile(drifts, .99), drifts[-1],
+    ))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,41 @@
+# Measure PeriodiqMiddleware.before_process_message() per message, comparing
+# legacy ISO 8601 scheduled_at with epoch milliseconds. Run with:
+# python tests/bench/bench_middleware.py [count]
+
+import sys
+from time import perf_counter, time
+
+import pendulum
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import PeriodiqMiddleware, cron
+
+
+def main(count=100000):
+    broker = StubBroker()
+    middleware = PeriodiqMiddleware()
+    broker.add_middleware(middleware)
+    periodic = actor(
+        lambda: None, broker=broker, actor_name='periodic',
+        periodic=cron('* * * * *'))
+    regular = actor(lambda: None, broker=broker, actor_name='regular')
+
+    messages = [
+        ('regular', regular.message()),
+        ('iso 8601', periodic.message_with_options(
+            scheduled_at=str(pendulum.now()))),
+        ('epoch ms', periodic.message_with_options(
+            scheduled_at=int(time() * 1000))),
+    ]
+    print("%10s %12s" % ('message', 'us/message'))
+    for name, message in messages:
+        start = perf_counter()
+        for _ in range(count):
+            middleware.before_process_message(broker, message)
+        elapsed = perf_counter() - start
+        print("%10s %12.2f" % (name, elapsed / count * 1e6))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,104 @@
+# Compare CronSpec.next_valid_date() with the former pendulum-based
+# implementation over a corpus of cron expressions. Run with:
+# python tests/bench/bench_next_valid_date.py
+
+from calendar import monthrange
+from time import perf_counter
+
+import pendulum
+
+from periodiq import cron
+
+
+CORPUS = [
+    '* * * * *',
+    '*/5 * * * *',
+    '0 * * * *',
+    '30 18 * * *',
+    '1 2 * * *',
+    '0 9 * * mon-fri',
+    '30 18 * * thu',
+    '0 0 1 * *',
+    '30 18 15 * thu',
+    '0 0 31 * *',
+    '0 0 1 1 *',
+    '15,45 8-18/2 1-15 */3 *',
+]
+
+STARTS = [
+    pendulum.datetime(2019, 1, 31, 23, 59, 30),
+    pendulum.datetime(2019, 2, 28, 12, 24, 30),
+    pendulum.datetime(2019, 6, 15, 12, 24, 30),
+    pendulum.datetime(2019, 12, 31, 23, 59),
+    pendulum.datetime(2019, 3, 31, 1, 57, 30, tz='Europe/Paris'),
+    pendulum.datetime(2019, 10, 27, 2, 30, tz='Europe/Paris'),
+]
+
+
+def first(function, iterable):
+    return next(x for x in iterable if function(x))
+
+
+def monthesrange(start_year, start_month, end_month):
+    start_month -= 1
+    end_month -= 1
+    return (
+        x for _, x in (
+            monthrange(start_year + m // 12, 1 + m % 12)
+            for m in range(start_month, end_month)
+        )
+    )
+
+
+def legacy_next_valid_date(spec, last):
+    # Former implementation, relying on pendulum .add() for each field.
+    minute_e = spec.minute + [60 + spec.minute[0]]
+    hour_e = spec.hour + [24 + spec.hour[0]]
+    month_e = spec.month + [12 + spec.month[0]]
+    dow_e = spec.dow + [7 + spec.dow[0]]
+
+    n = last.replace(second=0, microsecond=0)
+    n = n.add(minutes=1)
+    n = n.add(minutes=first(lambda x: x >= n.minute, minute_e) - n.minute)
+    n = n.add(hours=first(lambda x: x >= n.hour, hour_e) - n.hour)
+    last_dow = n.isoweekday() % 7
+    delay_dow = first(lambda x: x >= last_dow, dow_e) - last_dow
+    _, month_days = monthrange(n.year, n.month)
+    dom_e = [
+        x for x in spec.dom if x <= month_days
+    ] + [month_days + spec.dom[0]]
+    delay_dom = first(lambda x: x >= n.day, dom_e) - n.day
+    if spec.is_dow_restricted and spec.is_dom_restricted:
+        delay_d = min(delay_dow, delay_dom)
+    else:
+        delay_d = delay_dow if spec.is_dow_restricted else delay_dom
+    n = n.add(days=delay_d)
+    next_month = first(lambda x: x >= n.month, month_e)
+    n = n.add(days=sum(monthesrange(n.year, n.month, next_month)))
+    return n
+
+
+def measure(function, specs, rounds):
+    t0 = perf_counter()
+    for _ in range(rounds):
+        for spec in specs:
+            for start in STARTS:
+                function(spec, start)
+    calls = rounds * len(specs) * len(STARTS)
+    return (perf_counter() - t0) / calls * 1e6
+
+
+def main(rounds=200):
+    specs = [cron(s) for s in CORPUS]
+    print("%-24s %12s %12s" % ('spec', 'legacy (us)', 'current (us)'))
+    for spec in specs:
+        legacy = measure(legacy_next_valid_date, [spec], rounds)
+        current = measure(type(spec).next_valid_date, [spec], rounds)
+        print("%-24s %12.2f %12.2f" % (spec, legacy, current))
+    legacy = measure(legacy_next_valid_date, specs, rounds)
+    current = measure(type(specs[0]).next_valid_date, specs, rounds)
+    print("%-24s %12.2f %12.2f" % ('all', legacy, current))
+
+
+if __name__ == '__main__':
+    main()
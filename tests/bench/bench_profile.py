@@ -0,0 +1,49 @@
+# Compare computing load profile from specs to simulating runs, for actors at
+# random times of day over a week. Run with:
+# python tests/bench/bench_profile.py [actors] [specs]
+
+import random
+import sys
+from time import perf_counter
+
+import pendulum
+
+from periodiq import LoadProfile, Simulation, cron
+
+
+class FakeActor:
+    def __init__(self, name, spec, queue_name):
+        self.actor_name = name
+        self.queue_name = queue_name
+        self.options = dict(periodic=spec)
+
+
+def main(count=10000, specs=1440):
+    rand = random.Random(count)
+    specs = [
+        cron('%d %d * * *' % (rand.randrange(60), rand.randrange(24)),
+             tz='Europe/Paris')
+        for _ in range(min(count, specs))
+    ] + [cron('*/5 * * * *', tz='Europe/Paris')]
+    actors = [
+        FakeActor('actor%d' % i, specs[i % len(specs)], 'q%d' % (i % 4))
+        for i in range(count)]
+    start = pendulum.datetime(2019, 6, 17, tz='Europe/Paris')
+
+    began = perf_counter()
+    profile = LoadProfile(actors, start, days=7)
+    expand = perf_counter() - began
+
+    began = perf_counter()
+    simulation = Simulation(actors, start, start.add(days=7))
+    simulation.loop()
+    simulate = perf_counter() - began
+
+    print("%8s %8s %10s %10s %10s" % (
+        'actors', 'specs', 'runs', 'profile', 'simulate'))
+    print("%8d %8d %10d %8.1fms %8.1fms" % (
+        count, len(specs), profile.total(), expand * 1000, simulate * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
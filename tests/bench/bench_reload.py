@@ -0,0 +1,50 @@
+# Compare applying a reload in place to rebuilding the Scheduler queue, for a
+# few changed actors among many. Run with:
+# python tests/bench/bench_reload.py [actors] [changed]
+
+import sys
+from time import perf_counter
+
+import pendulum
+
+from periodiq import Scheduler, cron
+
+
+SPECS = ['* * * * *', '*/15 * * * *', '@hourly', '@daily', '0 9 * * 1-5']
+
+
+class FakeActor:
+    def __init__(self, name, spec):
+        self.actor_name = name
+        self.options = dict(periodic=cron(spec))
+
+
+def main(count=100000, changed=100):
+    now = pendulum.datetime(2019, 6, 15, 12, 30)
+    actors = [
+        FakeActor('actor%d' % i, SPECS[i % len(SPECS)]) for i in range(count)]
+    scheduler = Scheduler(actors=actors)
+    scheduler.pop_due(now)
+
+    # Change spec of some actors, redeclare others with same spec.
+    reloaded = list(actors)
+    for i in range(changed):
+        reloaded[i] = FakeActor('actor%d' % i, '30 * * * *')
+    for i in range(changed, 2 * changed):
+        reloaded[i] = FakeActor('actor%d' % i, SPECS[i % len(SPECS)])
+
+    start = perf_counter()
+    scheduler.update(reloaded, now)
+    update = perf_counter() - start
+
+    start = perf_counter()
+    Scheduler(actors=reloaded).pop_due(now)
+    rebuild = perf_counter() - start
+
+    print("%8s %8s %12s %12s" % ('actors', 'changed', 'update', 'rebuild'))
+    print("%8d %8d %10.1fms %10.1fms" % (
+        count, changed, update * 1000, rebuild * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,70 @@
+# Measure how Scheduler wakeup latency grows with the number of periodic
+# actors. Run with: python tests/bench/bench_scheduler.py
+
+import random
+import sys
+from time import perf_counter
+
+import pendulum
+
+from periodiq import Scheduler, cron
+
+
+class FakeActor:
+    def __init__(self, name, spec):
+        self.actor_name = name
+        self.options = dict(periodic=spec)
+
+
+def make_actors(count):
+    rand = random.Random(count)
+    specs = [
+        cron('%d %d * * *' % (rand.randrange(60), rand.randrange(24)))
+        for _ in range(min(count, 1440))
+    ]
+    return [
+        FakeActor('actor%d' % i, specs[i % len(specs)])
+        for i in range(count)
+    ]
+
+
+def full_recompute(actors, now):
+    # Former algorithm, validating and sorting every actor at each wakeup.
+    due = [a for a in actors if a.options['periodic'].validate(now)]
+    prioritized = sorted([
+        (a.options['periodic'].next_valid_date(now), a) for a in actors
+    ], key=lambda x: x[0])
+    return due, prioritized[0][0]
+
+
+def main(sizes):
+    start = pendulum.datetime(2019, 6, 15, 0, 0)
+    print("%8s %14s %14s %8s" % ('actors', 'heap (ms)', 'full (ms)', 'due'))
+    for count in sizes:
+        actors = make_actors(count)
+        scheduler = Scheduler(actors=actors)
+        scheduler.pop_due(start)
+
+        ticks, due, elapsed = 0, 0, 0.
+        now = start
+        while ticks < 50:
+            now = scheduler.queue[0][2]
+            t0 = perf_counter()
+            due += len(scheduler.pop_due(now))
+            elapsed += perf_counter() - t0
+            ticks += 1
+        heap_ms = elapsed / ticks * 1000
+
+        if count <= 10000:
+            t0 = perf_counter()
+            full_recompute(actors, now)
+            full_ms = '%14.3f' % ((perf_counter() - t0) * 1000)
+        else:
+            full_ms = '%14s' % 'skipped'
+
+        print("%8d %14.3f %s %8.1f" % (count, heap_ms, full_ms, due / ticks))
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 100, 1000, 10000, 100000]
+    main(sizes)
@@ -0,0 +1,52 @@
+# Measure SQLiteSchedules.pop_due() as the number of stored schedules grows,
+# with a constant number of due schedules per tick. Run with:
+# python tests/bench/bench_schedules.py [due] [sizes...]
+
+import json
+import random
+import sys
+from time import perf_counter
+
+import pendulum
+
+from periodiq import SQLiteSchedules
+
+
+def fill(store, count, start):
+    # Bulk insert count daily schedules, spread over the day after start.
+    rand = random.Random(count)
+    rows = []
+    for i in range(count):
+        minute = rand.randrange(1, 1440)
+        spec = '%d %d * * *' % (minute % 60, minute // 60)
+        rows.append((
+            'tenant%d' % i, 'report', spec,
+            None, json.dumps(['tenant%d' % i]), '{}',
+            start.timestamp() + minute * 60,
+        ))
+    with store.db:
+        store.db.executemany(
+            "INSERT INTO periodiq_schedule VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows)
+
+
+def main(due=100, sizes=(10000, 100000, 1000000)):
+    start = pendulum.datetime(2019, 6, 15)
+    print("%10s %8s %14s" % ('schedules', 'due', 'pop_due (ms)'))
+    for count in sizes:
+        store = SQLiteSchedules(':memory:')
+        fill(store, count, start)
+        # Make exactly due rows due, at the first minute.
+        with store.db:
+            store.db.execute(
+                "UPDATE periodiq_schedule SET next_fire = ? WHERE rowid <= ?",
+                (start.timestamp(), due))
+        elapsed = perf_counter()
+        popped = store.pop_due(start)
+        elapsed = perf_counter() - elapsed
+        print("%10d %8d %14.3f" % (count, len(popped), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args[:1], **(dict(sizes=args[1:]) if args[1:] else {}))
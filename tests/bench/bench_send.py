@@ -0,0 +1,50 @@
+# Measure Scheduler.send_actors() against a StubBroker with injected enqueue
+# latency. Run with: python tests/bench/bench_send.py [latency_ms]
+
+import logging
+import sys
+from time import perf_counter, sleep
+
+import pendulum
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+import periodiq
+from periodiq import PeriodiqMiddleware, Scheduler, cron
+
+
+class SlowBroker(StubBroker):
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def enqueue(self, message, *, delay=None):
+        sleep(self.latency)
+        return super().enqueue(message, delay=delay)
+
+
+def main(latency_ms=2.):
+    periodiq.logger.setLevel(logging.WARNING)
+    now = pendulum.now()
+    print("%8s %8s %12s" % ('actors', 'workers', 'send (ms)'))
+    for count in 10, 100, 500:
+        broker = SlowBroker(latency_ms / 1000.)
+        broker.add_middleware(PeriodiqMiddleware())
+        actors = [
+            actor(
+                lambda: None, broker=broker, actor_name='actor%d' % i,
+                periodic=cron('0 * * * *'),
+            )
+            for i in range(count)
+        ]
+        for workers in 1, 8, 32:
+            scheduler = Scheduler(actors=actors, send_workers=workers)
+            t0 = perf_counter()
+            scheduler.send_actors(actors, now=now)
+            elapsed = perf_counter() - t0
+            broker.flush_all()
+            print("%8d %8d %12.1f" % (count, workers, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
@@ -0,0 +1,58 @@
+# Measure Scheduler throughput by simulating daily actors at random times over
+# a period, without sleeping nor sending. Run with:
+# python tests/bench/bench_simulate.py [actors] [days] [specs] [mixed]
+#
+# Cost is per run, not per actor. Daily actors fire once a day, the best case.
+# Pass mixed=1 for a realistic mix of hourly, */15, */5, weekday and daily
+# actors: ~830k runs per day for 10k actors, a few seconds per simulated day.
+
+import random
+import sys
+from io import StringIO
+from time import perf_counter
+
+import pendulum
+
+from periodiq import Simulation, cron
+
+
+class FakeActor:
+    def __init__(self, name, spec):
+        self.actor_name = name
+        self.options = dict(periodic=spec)
+
+
+MIXED = ['@hourly', '*/15 * * * *', '*/5 * * * *', '0 9 * * 1-5', '@daily']
+
+
+def main(count=10000, days=365, specs=1440, mixed=0):
+    rand = random.Random(count)
+    if mixed:
+        specs = [cron(spec, tz='Europe/Paris') for spec in MIXED]
+    else:
+        specs = [
+            cron('%d %d * * *' % (rand.randrange(60), rand.randrange(24)),
+                 tz='Europe/Paris')
+            for _ in range(min(count, specs))
+        ]
+    actors = [
+        FakeActor('actor%d' % i, specs[i % len(specs)]) for i in range(count)]
+    start = pendulum.datetime(2019, 1, 1, tz='Europe/Paris')
+    simulation = Simulation(actors, start, start.add(days=days))
+
+    began = perf_counter()
+    simulation.loop()
+    elapsed = perf_counter() - began
+    began = perf_counter()
+    simulation.write(StringIO())
+    written = perf_counter() - began
+
+    runs = len(simulation.runs)
+    print("%8s %8s %10s %10s %10s %12s" % (
+        'actors', 'specs', 'runs', 'simulate', 'write', 'runs/s'))
+    print("%8d %8d %10d %9.1fs %9.1fs %12d" % (
+        count, len(specs), runs, elapsed, written, runs / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,45 @@
+# Show how spread flattens enqueue bursts of hourly actors. Walks Scheduler
+# wake ups over one hour without sleeping. Run with:
+# python tests/bench/bench_spread.py [actors] [spread]
+
+import collections
+import sys
+
+import pendulum
+
+from periodiq import Scheduler, cron
+
+
+class FakeActor:
+    def __init__(self, name, spec):
+        self.actor_name = name
+        self.options = dict(periodic=spec)
+
+
+def burst(count, spread):
+    # Returns max actors per tick and per second, and number of ticks.
+    actors = [FakeActor('actor%d' % i, cron('@hourly')) for i in range(count)]
+    scheduler = Scheduler(actors=actors, spread=spread)
+    now = pendulum.datetime(2019, 6, 15, 12, 30)
+    scheduler.pop_due(now)
+    per_second = collections.Counter()
+    ticks = []
+    end = now.add(hours=1)
+    while now < end:
+        now = scheduler.next_wakeup()
+        due = scheduler.pop_due(now)
+        ticks.append(len(due))
+        per_second[int(now.timestamp())] += len(due)
+    return max(ticks), max(per_second.values()), len(ticks)
+
+
+def main(count=500, spread=60):
+    print("%8s %8s %12s %12s %8s" % (
+        'actors', 'spread', 'max/tick', 'max/second', 'ticks'))
+    for window in 0, spread:
+        print("%8d %8d %12d %12d %8d" % ((count, window) + burst(
+            count, window)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,112 @@
+# pytest-benchmark suite of CronSpec parsing, search and validation.
+
+import pendulum
+import pytest
+
+from periodiq import CronSpec
+
+
+# Specs found in the wild: shortcuts, ranges, steps, lists and names.
+CORPUS = [
+    '* * * * *',
+    '*/5 * * * *',
+    '*/15 * * * *',
+    '0 * * * *',
+    '@hourly',
+    '@daily',
+    '@weekly',
+    '@monthly',
+    '@yearly',
+    '0 0 * * *',
+    '30 2 * * *',
+    '0 9 * * mon-fri',
+    '0 9-17 * * 1-5',
+    '*/10 8-20 * * mon,wed,fri',
+    '15,45 * * * *',
+    '0 0 1 * *',
+    '0 18 1,15 * *',
+    '0 0 1 1 *',
+    '0 0 29 2 *',
+    '0 12 * 1-3 *',
+    '5 4 * * sun',
+    '0 22 * * 1-5',
+    '23 0-20/2 * * *',
+    '0 0 13 * fri',
+    '59 23 31 12 *',
+    '1 2 * * *',
+    '0 */6 * * *',
+    '30 10 * * Sun',
+    '0 0 25 12 *',
+    '0 3 * * 7',
+]
+
+# Boundaries where search carries to next field, or wall clock is skipped or
+# repeated.
+STARTS = [
+    ('UTC', 'month', (2019, 1, 31, 23, 59)),
+    ('UTC', 'leap', (2020, 2, 28, 23, 59)),
+    ('UTC', 'year', (2019, 12, 31, 23, 59)),
+    ('Europe/Paris', 'dst-forward', (2019, 3, 31, 1, 59)),
+    ('Europe/Paris', 'dst-back', (2019, 10, 27, 0, 59)),
+    ('America/New_York', 'dst-forward', (2019, 3, 10, 1, 59)),
+    ('America/New_York', 'dst-back', (2019, 11, 3, 0, 59)),
+    ('Australia/Sydney', 'dst-back', (2019, 4, 7, 1, 59)),
+    ('Australia/Sydney', 'dst-forward', (2019, 10, 6, 1, 59)),
+    ('Asia/Kolkata', 'year', (2019, 12, 31, 23, 59)),
+]
+
+
+def test_parse(benchmark):
+    def parse():
+        # Defeat parse and intern caches, measuring parsing itself.
+        CronSpec.parse.cache_clear()
+        CronSpec.intern.cache_clear()
+        for spec in CORPUS:
+            CronSpec.parse(spec)
+
+    benchmark(parse)
+
+
+def test_parse_cached(benchmark):
+    for spec in CORPUS:
+        CronSpec.parse(spec)
+
+    def parse():
+        for spec in CORPUS:
+            CronSpec.parse(spec)
+
+    benchmark(parse)
+
+
+@pytest.mark.parametrize(
+    'tz, boundary, start', STARTS,
+    ids=['%s-%s' % (tz, boundary) for tz, boundary, _ in STARTS])
+def test_next_valid_date(benchmark, tz, boundary, start):
+    specs = [CronSpec.parse(spec) for spec in CORPUS]
+    start = pendulum.datetime(*start, tz=tz)
+
+    def search():
+        for spec in specs:
+            spec.next_valid_date(start)
+
+    benchmark(search)
+
+
+def test_next_n(benchmark):
+    # A week of minutely runs through Paris DST change.
+    spec = CronSpec.parse('* * * * *')
+    start = pendulum.datetime(2019, 10, 24, tz='Europe/Paris')
+    benchmark(spec.next_n, start, 10080)
+
+
+def test_validate(benchmark):
+    specs = [CronSpec.parse(spec) for spec in CORPUS]
+    start = pendulum.datetime(2019, 12, 31, 23, tz='Europe/Paris')
+    dates = [start.add(minutes=i) for i in range(120)]
+
+    def validate():
+        for date in dates:
+            for spec in specs:
+                spec.validate(date)
+
+    benchmark(validate)
@@ -0,0 +1,70 @@
+# pytest-benchmark suite of end-to-end Scheduler.schedule() on a StubBroker.
+
+import pendulum
+import pytest
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import PeriodiqMiddleware, Scheduler, cron
+
+
+ZONES = [
+    'UTC', 'Europe/Paris', 'Europe/London', 'Europe/Moscow',
+    'America/New_York', 'America/Chicago', 'America/Denver',
+    'America/Los_Angeles', 'America/Sao_Paulo', 'America/Mexico_City',
+    'America/Toronto', 'America/Bogota', 'America/Santiago',
+    'America/Halifax', 'America/St_Johns', 'America/Anchorage',
+    'Pacific/Honolulu', 'Pacific/Auckland', 'Pacific/Chatham',
+    'Australia/Sydney', 'Australia/Adelaide', 'Australia/Perth',
+    'Asia/Tokyo', 'Asia/Seoul', 'Asia/Shanghai', 'Asia/Kolkata',
+    'Asia/Kathmandu', 'Asia/Dubai', 'Asia/Tehran', 'Asia/Jakarta',
+    'Asia/Singapore', 'Asia/Karachi', 'Africa/Cairo', 'Africa/Lagos',
+    'Africa/Johannesburg', 'Africa/Nairobi', 'Europe/Berlin',
+    'Europe/Istanbul', 'Europe/Lisbon', 'Atlantic/Azores',
+]
+
+
+def run_schedule(benchmark, monkeypatch, count, zones=(None,)):
+    broker = StubBroker()
+    broker.add_middleware(PeriodiqMiddleware())
+
+    def noop():
+        pass
+
+    # Hourly actors spread over minutes, 1/60 of actors are due per tick.
+    actors = [
+        actor(
+            noop, broker=broker, actor_name='actor%d' % i,
+            periodic=cron('%d * * * *' % (i % 60), tz=zones[i % len(zones)]))
+        for i in range(count)
+    ]
+    scheduler = Scheduler(actors=actors)
+
+    # Wake up one minute later on each call, a few ms after due date.
+    clock = [pendulum.datetime(2019, 6, 15, 12, 0, 0, 2000)]
+
+    def now(tz=None):
+        date = clock[0]
+        clock[0] = date.add(minutes=1)
+        return date
+
+    monkeypatch.setattr('periodiq.pendulum.now', now)
+    # First tick schedules all actors.
+    scheduler.schedule()
+
+    benchmark.pedantic(
+        scheduler.schedule, setup=broker.flush_all, rounds=60,
+        warmup_rounds=1)
+    if scheduler.executor is not None:
+        scheduler.executor.shutdown()
+
+
+@pytest.mark.parametrize('count', [10, 1000, 100000])
+def test_schedule(benchmark, monkeypatch, count):
+    run_schedule(benchmark, monkeypatch, count)
+
+
+@pytest.mark.parametrize('zones', [1, 10, 40])
+def test_schedule_zones(benchmark, monkeypatch, zones):
+    # Cost of 10k actors must not depend on number of timezones.
+    run_schedule(benchmark, monkeypatch, 10000, zones=ZONES[:zones])
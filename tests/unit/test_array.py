@@ -0,0 +1,46 @@
+import pytest
+
+
+def test_matrix():
+    numpy = pytest.importorskip('numpy')
+    from periodiq import CronArray, cron
+
+    specs = [
+        cron('* * * * *'),
+        cron('*/15 * * * *'),
+        cron('30 18 * * *'),
+        cron('0 0 * * sun'),
+        cron('0 0 * * 7'),
+        cron('30 18 15 * thu'),
+        cron('0 0 29 2 *'),
+        cron('0 9-17 * 1,3 mon-fri'),
+    ]
+    array = CronArray(specs)
+    times = numpy.concatenate([
+        numpy.arange(
+            '2019-01-13T00:00', '2019-01-18T00:00', dtype='datetime64[m]'),
+        numpy.arange(
+            '2020-02-28T23:00', '2020-03-02T01:00', dtype='datetime64[m]'),
+    ])
+    matrix = array.matrix(times)
+    assert (len(specs), len(times)) == matrix.shape
+
+    dates = times.tolist()
+    for i, spec in enumerate(specs):
+        wanted = [spec.validate(d) for d in dates]
+        assert wanted == matrix[i].tolist(), spec
+
+
+def test_pairs():
+    numpy = pytest.importorskip('numpy')
+    from periodiq import CronArray, cron
+
+    array = CronArray([cron('@hourly'), cron('*/30 * * * *')])
+    times = numpy.arange(
+        '2019-06-15T00:00', '2019-06-15T02:00', dtype='datetime64[m]')
+    indexes, dates = array.pairs(times, chunk=45)
+    assert [0, 1, 1, 0, 1, 1] == indexes.tolist()
+    assert [
+        '2019-06-15T00:00', '2019-06-15T00:00', '2019-06-15T00:30',
+        '2019-06-15T01:00', '2019-06-15T01:00', '2019-06-15T01:30',
+    ] == [str(d) for d in dates]
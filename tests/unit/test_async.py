@@ -0,0 +1,104 @@
+import asyncio
+
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import actor
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('* * * * *'))
+def minutely():
+    pass
+
+
+@actor(broker=broker, periodic=cron('* * * * *'))
+def minutely_too():
+    pass
+
+
+@actor(broker=broker, periodic=cron('@daily'))
+def daily():
+    pass
+
+
+def test_run_cancel():
+    from periodiq import AsyncScheduler
+
+    scheduler = AsyncScheduler(actors=[minutely, minutely_too])
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.run())
+        # The loop is not blocked while scheduler sleeps.
+        for _ in range(50):
+            if broker.queues['default'].qsize() >= 2:
+                break
+            await asyncio.sleep(.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return task
+
+    task = asyncio.new_event_loop().run_until_complete(main())
+    assert task.cancelled()
+    assert scheduler.executor is None
+    assert broker.queues['default'].qsize() >= 2
+
+
+def test_run_empty():
+    from periodiq import AsyncScheduler
+
+    scheduler = AsyncScheduler(actors=[], poll_interval=.01)
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.run())
+        # Nothing to schedule, scheduler polls for a reload.
+        await asyncio.sleep(.05)
+        assert not task.done()
+        scheduler.reload([minutely])
+        for _ in range(50):
+            if scheduler.actors:
+                break
+            await asyncio.sleep(.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return task
+
+    task = asyncio.new_event_loop().run_until_complete(main())
+    assert task.cancelled()
+    assert [minutely] == scheduler.actors
+
+
+def test_run_reload():
+    from periodiq import AsyncScheduler
+
+    scheduler = AsyncScheduler(actors=[daily])
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(.05)
+        # Reload from another thread wakes up scheduler, sleeping until
+        # midnight.
+        await asyncio.get_running_loop().run_in_executor(
+            None, scheduler.reload, [minutely])
+        for _ in range(50):
+            if not scheduler.pending:
+                break
+            await asyncio.sleep(.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.new_event_loop().run_until_complete(main())
+    assert [minutely] == scheduler.actors
+    assert scheduler.loop is None
@@ -1,5 +1,7 @@
 from pendulum import datetime
 
+import pytest
+
 
 def test_parse():
     from periodiq import cron
@@ -255,3 +257,238 @@ def test_format_interval():
     assert '0' == format_interval(start=0, stop=0)
     assert '1-2' == format_interval(start=1, stop=2)
     assert 'Sun,Mon' == format_interval(0, 1, names=['Sun', 'Mon', 'Tue'])
+
+
+def test_masks():
+    from periodiq import cron
+
+    spec = cron('25,50 */6 * * mon')
+    assert (1 << 25 | 1 << 50) == spec.minute_mask
+    assert [0, 6, 12, 18] == spec.hour
+    assert not spec.is_dom_restricted
+    assert spec.is_dow_restricted
+    assert not hasattr(spec, '__dict__')
+
+
+def test_next_set_bit():
+    from periodiq import next_set_bit, to_mask
+
+    mask = to_mask([25, 50])
+    assert 25 == next_set_bit(mask, 0, 60)
+    assert 25 == next_set_bit(mask, 25, 60)
+    assert 50 == next_set_bit(mask, 26, 60)
+    # Wraps to next hour.
+    assert 85 == next_set_bit(mask, 51, 60)
+
+
+def test_sunday():
+    from periodiq import cron
+
+    sunday = datetime(2019, 6, 16, 10, 30)
+    assert 7 == sunday.isoweekday()
+    for spec in '30 10 * * 0', '30 10 * * 7', '30 10 * * sun':
+        assert cron(spec).validate(sunday)
+        s = cron(spec).next_valid_date(datetime(2019, 6, 14))
+        assert sunday == s
+
+
+def test_month_and_dow():
+    from periodiq import cron
+
+    # Mondays of June.
+    s = cron('0 0 * 6 mon').next_valid_date(datetime(2019, 2, 10))
+    assert datetime(2019, 6, 3) == s
+
+    # Leap day.
+    s = cron('0 0 29 2 *').next_valid_date(datetime(2019, 2, 10))
+    assert datetime(2020, 2, 29) == s
+
+
+def test_never():
+    from periodiq import cron
+
+    with pytest.raises(ValueError):
+        cron('0 0 30 2 *').next_valid_date(datetime(2019, 2, 10))
+
+
+def test_dst_back():
+    from periodiq import cron
+
+    # 02:59 CEST. Clock goes back from 03:00 CEST to 02:00 CET.
+    d = datetime(2019, 10, 27, 0, 59).in_timezone('Europe/Paris')
+    assert 2 == d.hour
+    s = cron('* * * * *').next_valid_date(d)
+    assert datetime(2019, 10, 27, 1, 0) == s.in_timezone('UTC')
+
+    # Don't run twice in repeated hour.
+    d = datetime(2019, 10, 27, 0, 31).in_timezone('Europe/Paris')
+    s = cron('30 2 * * *').next_valid_date(d)
+    assert datetime(2019, 10, 28, 2, 30, tz='Europe/Paris') == s
+
+    # Sub-daily specs walk through repeated hour.
+    d = datetime(2019, 10, 26, 23, 40).in_timezone('Europe/Paris')
+    dates = cron('*/15 * * * *').next_n(d, 10)
+    assert [
+        datetime(2019, 10, 26, 23, 45).add(minutes=15 * i) for i in range(10)
+    ] == [x.in_timezone('UTC') for x in dates]
+    assert [0] * 5 + [1] * 4 + [0] == [x.fold for x in dates]
+    dates = cron('@hourly').next_n(d, 4)
+    assert [
+        datetime(2019, 10, 27, 0), datetime(2019, 10, 27, 1),
+        datetime(2019, 10, 27, 2), datetime(2019, 10, 27, 3),
+    ] == [x.in_timezone('UTC') for x in dates]
+    assert [2, 2, 3, 4] == [x.hour for x in dates]
+
+
+def test_iter_dates():
+    from periodiq import cron
+
+    spec = cron('30 18 * * mon,thu')
+    start = datetime(2019, 2, 18, 18, 30)
+    dates = list(spec.iter_dates(start, end=datetime(2019, 3, 4, 18, 30)))
+    assert [
+        datetime(2019, 2, 21, 18, 30),
+        datetime(2019, 2, 25, 18, 30),
+        datetime(2019, 2, 28, 18, 30),
+        datetime(2019, 3, 4, 18, 30),
+    ] == dates
+
+    assert dates[:2] == spec.next_n(start, 2)
+
+    # Unbounded.
+    dates = spec.iter_dates(start)
+    assert datetime(2019, 2, 21, 18, 30) == next(dates)
+    assert datetime(2019, 2, 25, 18, 30) == next(dates)
+
+
+def test_iter_dates_dst():
+    from periodiq import cron
+
+    start = datetime(2019, 3, 29, 12, tz='Europe/Paris')
+    dates = cron('1 2 * * *').next_n(start, 3)
+    assert [
+        datetime(2019, 3, 30, 2, 1, tz='Europe/Paris'),
+        datetime(2019, 4, 1, 2, 1, tz='Europe/Paris'),
+        datetime(2019, 4, 2, 2, 1, tz='Europe/Paris'),
+    ] == dates
+
+    start = datetime(2019, 10, 26, 23, 30).in_timezone('Europe/Paris')
+    dates = cron('*/30 * * * *').next_n(start, 4)
+    assert [
+        datetime(2019, 10, 27, 0, 0),
+        datetime(2019, 10, 27, 0, 30),
+        datetime(2019, 10, 27, 1, 0),
+        datetime(2019, 10, 27, 1, 30),
+    ] == [d.in_timezone('UTC') for d in dates]
+
+    # Same as chaining next_valid_date().
+    spec = cron('* * * * *')
+    dates = spec.next_n(start, 200)
+    last = start
+    for d in dates:
+        last = spec.next_valid_date(last)
+        assert last.timestamp() == d.timestamp()
+    assert 200 == len(set(d.timestamp() for d in dates))
+
+
+def test_cache():
+    from copy import deepcopy
+    from pickle import dumps, loads
+    from periodiq import CronSpec, cron
+
+    info = CronSpec.parse.cache_info()
+    spec = cron('*/7 * * * *')
+    assert spec is cron('*/7 * * * *')
+    assert info.hits + 1 == CronSpec.parse.cache_info().hits
+
+    with pytest.raises(AttributeError):
+        spec.minute_mask = 0
+
+    assert spec.replace(m=[0]) is spec.replace(m=[0])
+    assert spec.replace(m=[0]) is cron('0 * * * *').replace(m=[0])
+    assert {spec} == {cron('0-59/7 * * * *')}
+    assert spec is deepcopy(spec)
+    assert spec is loads(dumps(spec))
+    assert spec.replace(h=[1]) is loads(dumps(spec.replace(h=[1])))
+
+
+def test_timezone():
+    from pickle import dumps, loads
+    from periodiq import cron
+
+    spec = cron('0 9 * * *', tz='Asia/Tokyo')
+    assert spec is cron('0 9 * * *', tz='Asia/Tokyo')
+    assert spec != cron('0 9 * * *')
+    assert spec is loads(dumps(spec))
+    assert 'Asia/Tokyo' == spec.replace(m=[30]).tz
+
+    # 21:00 in Tokyo.
+    s = spec.next_valid_date(datetime(2019, 6, 15, 12, tz='UTC'))
+    assert datetime(2019, 6, 16, 0, tz='UTC') == s.in_timezone('UTC')
+    assert 9 == s.hour
+    assert spec.validate(datetime(2019, 6, 16, 0, tz='UTC'))
+    assert not spec.validate(datetime(2019, 6, 16, 9, tz='UTC'))
+
+    # 09:00 in Paris is 07:00 UTC in summer, 08:00 UTC in winter.
+    spec = cron('0 9 * * *', tz='Europe/Paris')
+    dates = spec.next_n(datetime(2019, 10, 26, 6, tz='UTC'), 2)
+    assert [7, 8] == [d.in_timezone('UTC').hour for d in dates]
+
+    with pytest.raises(ValueError):
+        cron('0 9 * * *', tz='Nowhere/Void')
+
+
+def test_seconds():
+    from periodiq import cron
+
+    spec = cron('*/20 * * * * *')
+    assert [0, 20, 40] == spec.second
+    assert spec != cron('* * * * *')
+    d = datetime(2019, 6, 15, 12, 24, 30, 500)
+    assert [
+        datetime(2019, 6, 15, 12, 24, 40),
+        datetime(2019, 6, 15, 12, 25, 0),
+        datetime(2019, 6, 15, 12, 25, 20),
+    ] == spec.next_n(d, 3)
+    assert spec.validate(datetime(2019, 6, 15, 12, 24, 40))
+    assert not spec.validate(datetime(2019, 6, 15, 12, 24, 41))
+    # 5 fields specs ignore seconds.
+    assert cron('* * * * *').validate(datetime(2019, 6, 15, 12, 24, 41))
+
+    # Next valid second in a later minute, hour and day.
+    spec = cron('15 30 2 * * *')
+    assert datetime(2019, 6, 16, 2, 30, 15) == spec.next_valid_date(
+        datetime(2019, 6, 15, 2, 30, 15))
+    assert '15 30 2 * * *' == str(spec)
+    assert '15 0 2 * * *' == str(spec.replace(m=[0]))
+    assert '0 2 * * *' == str(cron('0 2 * * *').replace(h=[2]))
+
+    # Skips nonexistent wall-clock time.
+    d = datetime(2019, 3, 31, 0, 59, 50).in_timezone('Europe/Paris')
+    s = cron('*/30 * * * * *').next_n(d, 2)
+    assert [
+        datetime(2019, 3, 31, 1, 0, 0),
+        datetime(2019, 3, 31, 1, 0, 30),
+    ] == [x.in_timezone('UTC') for x in s]
+    assert 3 == s[0].hour
+
+
+def test_every():
+    from pickle import dumps, loads
+    from periodiq import every
+
+    spec = every(seconds=5)
+    assert spec == every(seconds=5)
+    assert spec == loads(dumps(spec))
+    assert '@every 5s' == str(spec)
+    assert [
+        datetime(2019, 6, 15, 12, 0, 5),
+        datetime(2019, 6, 15, 12, 0, 10),
+    ] == spec.next_n(datetime(2019, 6, 15, 12, 0, 3, 900), 2)
+    assert spec.validate(datetime(2019, 6, 15, 12, 0, 5))
+    assert not spec.validate(datetime(2019, 6, 15, 12, 0, 6))
+    assert datetime(2019, 6, 15, 14) == every(hours=2).next_valid_date(
+        datetime(2019, 6, 15, 12))
+
+    with pytest.raises(ValueError):
+        every(seconds=.5)
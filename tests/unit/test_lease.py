@@ -0,0 +1,84 @@
+from time import sleep
+
+import pytest
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import actor
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('* * * * *'))
+def minutely():
+    pass
+
+
+def check_lease(first, second):
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+
+    first.release()
+    assert second.acquire()
+    assert not first.acquire()
+
+    # Lease expires if holder does not renew it.
+    sleep(second.ttl + .05)
+    assert first.acquire()
+    first.release()
+
+
+def test_local_lease():
+    from periodiq import LocalLease
+
+    check_lease(
+        LocalLease(key='test', ttl=.2),
+        LocalLease(key='test', ttl=.2),
+    )
+
+
+def test_redis_lease():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import RedisLease
+
+    client = fakeredis.FakeRedis()
+    check_lease(
+        RedisLease(client, key='test', ttl=.2),
+        RedisLease(client, key='test', ttl=.2),
+    )
+
+
+def test_shard_leases():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import make_lease
+
+    class Broker:
+        client = fakeredis.FakeRedis()
+
+    # Shards don't compete for the same lease.
+    assert make_lease(Broker, ttl=10, shard=(0, 2)).acquire()
+    assert make_lease(Broker, ttl=10, shard=(1, 2)).acquire()
+    assert not make_lease(Broker, ttl=10, shard=(1, 2)).acquire()
+
+
+def test_standby():
+    from pendulum import datetime
+    from periodiq import LocalLease, Scheduler
+
+    broker.flush_all()
+    leader = Scheduler([minutely], lease=LocalLease(key='standby'))
+    standby = Scheduler([minutely], lease=LocalLease(key='standby'))
+    for scheduler in leader, standby:
+        scheduler.schedule()
+    assert leader.leader
+    assert not standby.leader
+    assert 1 == broker.queues['default'].qsize()
+    # Standby maintains its queue to take over.
+    assert standby.queue[0][2] > datetime(2019, 1, 1)
+
+    leader.lease.release()
+    assert standby.is_leader()
+    broker.flush_all()
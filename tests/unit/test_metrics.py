@@ -0,0 +1,114 @@
+from importlib.util import find_spec
+from urllib.request import urlopen
+
+from pendulum import datetime
+
+import pytest
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import actor
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('* * * * *'))
+def minutely():
+    pass
+
+
+def test_render():
+    from periodiq import Metrics
+
+    metrics = Metrics()
+    metrics.observe('periodiq_tick_actors', 5)
+    metrics.observe('periodiq_tick_actors', 50000)
+    metrics.inc('periodiq_skipped_messages_total', actor='a"b')
+    lines = metrics.render().splitlines()
+
+    assert '# TYPE periodiq_tick_actors histogram' in lines
+    assert 'periodiq_tick_actors_bucket{le="1"} 0' in lines
+    assert 'periodiq_tick_actors_bucket{le="10"} 1' in lines
+    assert 'periodiq_tick_actors_bucket{le="10000"} 1' in lines
+    assert 'periodiq_tick_actors_bucket{le="+Inf"} 2' in lines
+    assert 'periodiq_tick_actors_sum 50005' in lines
+    assert 'periodiq_tick_actors_count 2' in lines
+    assert 'periodiq_skipped_messages_total{actor="a\\"b"} 1' in lines
+
+
+def test_scheduler_metrics():
+    from periodiq import Metrics, Scheduler
+
+    metrics = Metrics()
+    scheduler = Scheduler(actors=[minutely], metrics=metrics)
+    scheduler.tick(datetime(2019, 6, 15, 12, 0, 10))
+    scheduler.tick(datetime(2019, 6, 15, 12, 1, 0, 20000))
+
+    _, _, _, drift = metrics.metrics['periodiq_wakeup_drift_seconds']
+    # Only second tick is a wake up for a scheduled date.
+    assert 1 == sum(drift[()][:-1])
+    assert .02 == pytest.approx(drift[()][-1])
+    _, _, _, enqueue = metrics.metrics['periodiq_enqueue_seconds']
+    assert [(('actor', 'minutely'),)] == list(enqueue)
+
+
+def test_middleware_metrics(mocker):
+    from periodiq import Metrics, SkipMessage
+
+    metrics = Metrics()
+    middleware = PeriodiqMiddleware(metrics=metrics)
+    message = minutely.message_with_options(scheduled_at=1567076040000)
+    mocker.patch('periodiq.time').return_value = 1567076140.
+
+    with pytest.raises(SkipMessage):
+        middleware.before_process_message(broker, message)
+    _, _, _, skipped = metrics.metrics['periodiq_skipped_messages_total']
+    assert {(('actor', 'minutely'),): 1} == skipped
+
+
+def test_prometheus_metrics(mocker, monkeypatch, tmp_path):
+    from dramatiq.middleware import prometheus
+    from periodiq import SkipMessage
+
+    # Without Prometheus middleware, skipped messages are not counted.
+    middleware = PeriodiqMiddleware()
+    middleware.after_process_boot(broker)
+    assert middleware.skipped is None
+
+    # Multiprocess mode is enabled before prometheus_client is imported.
+    if find_spec('prometheus_client') is None:
+        pytest.skip("prometheus_client is not installed.")
+    monkeypatch.setattr(prometheus, 'DB_PATH', str(tmp_path))
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', '')
+    monkeypatch.setenv('prometheus_multiproc_dir', '')
+    workers = StubBroker(middleware=[prometheus.Prometheus()])
+    workers.add_middleware(middleware)
+    middleware.after_process_boot(workers)
+    import prometheus_client
+    from prometheus_client import multiprocess
+
+    message = minutely.message_with_options(scheduled_at=1567076040000)
+    mocker.patch('periodiq.time').return_value = 1567076140.
+    with pytest.raises(SkipMessage):
+        middleware.before_process_message(broker, message)
+
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+    assert 1 == registry.get_sample_value(
+        'periodiq_skipped_messages_total', dict(actor='minutely'))
+
+
+def test_serve_metrics():
+    from periodiq import Metrics, serve_metrics
+
+    metrics = Metrics()
+    metrics.inc('periodiq_skipped_messages_total', actor='minutely')
+    server = serve_metrics(metrics, port=0)
+    try:
+        url = 'http://127.0.0.1:%s/metrics' % server.server_address[1]
+        body = urlopen(url, timeout=5).read().decode('utf-8')
+    finally:
+        server.shutdown()
+    assert 'periodiq_skipped_messages_total{actor="minutely"} 1' in body
@@ -46,3 +46,101 @@ def test_process_ontime_message(mocker):
     now.return_value = datetime(2019, 8, 29, 10, 54, 1)
 
     middleware.before_process_message(broker, message)
+
+
+def test_epoch_scheduled_at(mocker):
+    from periodiq import SkipMessage
+
+    message = periodic_actor.message_with_options(scheduled_at=1567076040000)
+    time = mocker.patch('periodiq.time')
+    time.return_value = 1567076041.
+    middleware.before_process_message(broker, message)
+
+    time.return_value = 1567076040. + middleware.skip_delay + 1
+    with pytest.raises(SkipMessage):
+        middleware.before_process_message(broker, message)
+
+
+def test_process_backfill(mocker):
+    message = periodic_actor.message_with_options(
+        scheduled_at=str(datetime(2019, 8, 29, 10, 0, 0)),
+        periodiq_backfill=True,
+    )
+    now = mocker.patch('periodiq.pendulum.now')
+    now.return_value = datetime(2019, 8, 29, 10, 54, 1)
+
+    middleware.before_process_message(broker, message)
+
+
+def test_skip_duplicate(mocker):
+    from periodiq import LocalStore, SkipMessage
+
+    dedupe_middleware = PeriodiqMiddleware(dedupe=LocalStore())
+    now = mocker.patch('periodiq.pendulum.now')
+    now.return_value = datetime(2019, 8, 29, 10, 54, 1)
+
+    def send():
+        message = periodic_actor.message_with_options(
+            scheduled_at=str(datetime(2019, 8, 29, 10, 54, 0)),
+            periodiq_key='periodic_actor@1567076040',
+        )
+        dedupe_middleware.before_process_message(broker, message)
+
+    send()
+    with pytest.raises(SkipMessage):
+        send()
+
+
+def test_retry_duplicate():
+    from time import time
+    from dramatiq import Worker
+    from periodiq import LocalStore
+
+    retry_broker = StubBroker()
+    retry_broker.add_middleware(PeriodiqMiddleware(dedupe=LocalStore()))
+    attempts = []
+
+    @actor(broker=retry_broker, periodic=cron('* * * * *'), max_retries=1,
+           min_backoff=10, max_backoff=10)
+    def flaky():
+        attempts.append(len(attempts))
+        if 1 == len(attempts):
+            raise ValueError("First attempt fails.")
+
+    worker = Worker(retry_broker, worker_timeout=100)
+    worker.start()
+    try:
+        for _ in range(2):
+            flaky.send_with_options(
+                scheduled_at=int(time() * 1000),
+                periodiq_key='flaky@1567076040')
+        retry_broker.join(flaky.queue_name)
+        worker.join()
+    finally:
+        worker.stop()
+    # Failed run is retried, duplicate is skipped.
+    assert [0, 1] == attempts
+
+
+def test_redis_store():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import RedisStore
+
+    store = RedisStore(fakeredis.FakeRedis())
+    assert store.add('key', ttl=60)
+    assert not store.add('key', ttl=60)
+    assert store.add('other', ttl=60)
+
+
+def test_import_light():
+    # Workers import periodiq for the middleware. Keep CLI deps out.
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, periodiq; "
+        "print(' '.join(m for m in ('django', 'pkg_resources', 'pdb') "
+        "if m in sys.modules))"
+    )
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert b'' == out.strip()
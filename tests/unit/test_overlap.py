@@ -0,0 +1,184 @@
+import pendulum
+import pytest
+from dramatiq import actor, Message
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import cron, LocalStore, PeriodiqMiddleware
+
+
+broker = StubBroker()
+middleware = PeriodiqMiddleware(inflight=LocalStore())
+broker.add_middleware(middleware)
+
+
+@actor(broker=broker, periodic=cron('* * * * *'), periodic_max_instances=1)
+def slow():
+    pass
+
+
+@actor(broker=broker, periodic=cron('*/15 * * * *'), periodic_coalesce=True)
+def coalesced():
+    pass
+
+
+@actor(broker=broker, periodic=cron('* * * * *'), periodic_max_instances=1,
+       periodic_coalesce=True)
+def deferred():
+    pass
+
+
+@actor(broker=broker, periodic=cron('*/15 * * * *'))
+def backfilled():
+    pass
+
+
+def test_local_slots(mocker):
+    store = LocalStore()
+    assert store.acquire('key', 'a', limit=2, ttl=60)
+    assert store.acquire('key', 'b', limit=2, ttl=60)
+    assert not store.acquire('key', 'c', limit=2, ttl=60)
+    assert store.acquire('other', 'c', limit=2, ttl=60)
+    store.release('key', 'a')
+    store.release('key', 'unknown')
+    assert store.acquire('key', 'c', limit=2, ttl=60)
+
+    # Slots of lost runs expire.
+    monotonic = mocker.patch('periodiq.monotonic')
+    monotonic.return_value = 1e12
+    assert store.acquire('key', 'd', limit=2, ttl=60)
+
+
+def test_redis_slots():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import RedisStore
+
+    store = RedisStore(fakeredis.FakeRedis())
+    assert store.acquire('key', 'a', limit=1, ttl=60)
+    assert not store.acquire('key', 'b', limit=1, ttl=60)
+    store.release('key', 'a')
+    assert store.acquire('key', 'b', limit=1, ttl=60)
+    assert store.acquire('lost', 'a', limit=1, ttl=-1)
+    assert store.acquire('lost', 'b', limit=1, ttl=60)
+
+
+def test_max_instances():
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[slow])
+    now = pendulum.datetime(2019, 6, 15, 12, 30, tz='UTC')
+    queue = broker.queues['default']
+
+    def get():
+        return Message.decode(queue.get())
+
+    for minute in range(3):
+        scheduler.tick(now.add(minutes=minute))
+    # Runs are skipped while first one is queued.
+    assert 1 == queue.qsize()
+    assert now.add(minutes=2) == scheduler.last_fired['slow']
+
+    # Worker frees slot.
+    message = get()
+    middleware.after_ack(broker, message)
+    scheduler.tick(now.add(minutes=3))
+    assert 1 == queue.qsize()
+    scheduler.tick(now.add(minutes=4))
+    assert 1 == queue.qsize()
+
+    # Message failed for good frees its slot too.
+    message = get()
+    middleware.after_nack(broker, message)
+    scheduler.tick(now.add(minutes=5))
+    assert 1 == queue.qsize()
+
+
+def test_coalesce(tmp_path):
+    from periodiq import FileCheckpoint, Scheduler
+
+    broker.flush_all()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    last = pendulum.datetime(2019, 6, 15, 11, 0, tz='UTC')
+    checkpoint.save(dict(coalesced=last, backfilled=last))
+
+    def tick(now):
+        scheduler = Scheduler(
+            actors=[coalesced, backfilled], checkpoint=checkpoint,
+            catch_up='all')
+        scheduler.tick(now)
+        names = [
+            Message.decode(m).actor_name
+            for m in broker.queues['default'].queue]
+        broker.flush_all()
+        return names
+
+    # Missed 11:15 to 12:15, coalesced to latest one.
+    names = tick(pendulum.datetime(2019, 6, 15, 12, 20, tz='UTC'))
+    assert 1 == names.count('coalesced')
+    assert 5 == names.count('backfilled')
+
+    # A run due now covers missed runs.
+    checkpoint.save(dict(coalesced=last, backfilled=last))
+    names = tick(pendulum.datetime(2019, 6, 15, 12, 30, tz='UTC'))
+    assert 1 == names.count('coalesced')
+    assert 5 + 1 == names.count('backfilled')
+
+
+def test_defer():
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[deferred], poll_interval=1)
+    now = pendulum.datetime(2019, 6, 15, 12, 30, tz='UTC')
+    queue = broker.queues['default']
+    for minute in range(3):
+        scheduler.tick(now.add(minutes=minute))
+    assert 1 == queue.qsize()
+    # Latest skipped run is deferred, polled every second.
+    assert now.add(minutes=2) == scheduler.deferred['deferred'][0]
+    later = now.add(minutes=2, seconds=10)
+    assert later.add(seconds=1) == scheduler.next_wakeup(later)
+
+    scheduler.tick(later)
+    assert 1 == queue.qsize()
+    middleware.after_ack(broker, Message.decode(queue.get()))
+    scheduler.tick(later.add(seconds=1))
+    message = Message.decode(queue.get())
+    assert 'deferred@%d' % now.add(minutes=2).timestamp() == \
+        message.options['periodiq_key']
+    assert message.options['periodiq_backfill']
+    assert not scheduler.deferred
+    assert now.add(minutes=2) == scheduler.last_fired['deferred']
+
+
+def test_retry_keeps_slot():
+    from dramatiq import Worker
+    from periodiq import Scheduler
+
+    store = LocalStore()
+    retry_broker = StubBroker()
+    retry_broker.add_middleware(
+        PeriodiqMiddleware(skip_delay=120, inflight=store))
+    attempts = []
+
+    @actor(broker=retry_broker, periodic=cron('* * * * *'),
+           periodic_max_instances=1, max_retries=1, min_backoff=10,
+           max_backoff=10)
+    def flaky():
+        attempts.append(dict(store.slots['inflight:flaky']))
+        if 1 == len(attempts):
+            raise ValueError("First attempt fails.")
+
+    Scheduler(actors=[flaky]).tick(pendulum.now())
+    worker = Worker(retry_broker, worker_timeout=100)
+    worker.start()
+    try:
+        retry_broker.join(flaky.queue_name)
+        worker.join()
+    finally:
+        worker.stop()
+    # Retry runs holding the slot of the run, released once done.
+    assert 2 == len(attempts)
+    assert attempts[0].keys() == attempts[1].keys()
+    assert 1 == len(attempts[1])
+    assert {} == store.slots['inflight:flaky']
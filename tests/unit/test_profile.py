@@ -0,0 +1,93 @@
+from io import StringIO
+
+import pendulum
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import cron, every, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('@hourly'))
+def hourly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('@hourly'), periodic_spread=120)
+def late():
+    pass
+
+
+@actor(broker=broker, periodic=cron('0 0 * * *'), queue_name='reports')
+def nightly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('0 0 * * 1'), queue_name='reports')
+def weekly():
+    pass
+
+
+def walk(spec, start, end):
+    # Reference histogram from iter_dates().
+    histogram = [0] * int((end.timestamp() - start.timestamp()) // 60)
+    for date in spec.iter_dates(start.subtract(seconds=1), end):
+        if date < end:
+            histogram[int(date.timestamp() - start.timestamp()) // 60] += 1
+    return histogram
+
+
+def test_expand():
+    from periodiq import LoadProfile
+
+    specs = [
+        cron('* * * * *'),
+        cron('*/7 3-5 * * *'),
+        cron('30 2 * * *'),
+        cron('0 9 1,15 * 1-5'),
+        cron('0 0 29 2 *'),
+        cron('*/20 * * * * *'),
+        cron('0 9 * * *', tz='Asia/Tokyo'),
+        every(minutes=7),
+    ]
+    # DST ends in Paris, leap day and a plain week.
+    for start in (
+            pendulum.datetime(2019, 10, 25, 12, 30, 45, tz='Europe/Paris'),
+            pendulum.datetime(2020, 2, 26, tz='Europe/Paris'),
+            pendulum.datetime(2019, 6, 14, tz='Europe/Paris'),
+    ):
+        for spec in specs:
+            profile = LoadProfile([], start, days=7)
+            profile.add(spec, 'default')
+            floored = start.replace(second=0)
+            assert walk(spec, floored, floored.add(days=7)) == \
+                profile.histograms['default'], (spec, start)
+
+
+def test_peaks():
+    from periodiq import LoadProfile, spread_offset
+
+    start = pendulum.datetime(2019, 6, 17, tz='UTC')
+    profile = LoadProfile(
+        [hourly, late, nightly, weekly], start, days=1)
+    assert 24 * 2 + 2 == profile.total()
+    assert ['default', 'reports'] == sorted(profile.histograms)
+
+    peaks = profile.peaks(top=3)
+    # Monday midnight.
+    assert [(start, 2)] == peaks['reports']
+    # late is spread to 00:01.
+    assert 1 == int(spread_offset('late', 120) // 60)
+    assert [
+        (start, 1), (start.add(minutes=1), 1), (start.add(hours=1), 1),
+    ] == peaks['default']
+
+    out = StringIO()
+    profile.write(out, top=1)
+    assert [
+        'peak\tdefault\t2019-06-17T00:00:00+00:00\t1',
+        'peak\treports\t2019-06-17T00:00:00+00:00\t2',
+    ] == out.getvalue().splitlines()
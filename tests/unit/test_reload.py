@@ -0,0 +1,221 @@
+import sys
+from textwrap import dedent
+from time import sleep
+
+import pendulum
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+def declare(name, spec):
+    # Redeclare actor, as reloading its module would.
+    broker.actors.pop(name, None)
+    return actor(lambda: None, broker=broker, actor_name=name, periodic=spec)
+
+
+def test_update():
+    from periodiq import Scheduler
+
+    daily = declare('daily', cron('@daily'))
+    hourly = declare('hourly', cron('@hourly'))
+    yearly = declare('yearly', cron('@yearly'))
+    scheduler = Scheduler(actors=[daily, hourly, yearly])
+    now = pendulum.datetime(2019, 6, 15, 10, 30, tz='UTC')
+    assert [] == scheduler.pop_due(now)
+    next_daily = scheduler.entries['daily']
+
+    # Redeclare daily, change hourly to minutely, drop yearly, add another.
+    daily_ = declare('daily', cron('@daily'))
+    minutely = declare('hourly', cron('* * * * *'))
+    weekly = declare('weekly', cron('@weekly'))
+    scheduler.update([daily_, minutely, weekly], now)
+
+    entry = scheduler.entries['daily']
+    assert entry[3] is daily_
+    assert entry[2] == next_daily[2]
+    assert 'yearly' not in scheduler.entries
+    assert scheduler.next_wakeup() == now.add(minutes=1)
+
+    # Stale entries are skipped.
+    due = scheduler.pop_due(pendulum.datetime(2019, 6, 17, tz='UTC'))
+    assert [daily_, minutely, weekly] == sorted(
+        (a for _, a in due), key=lambda a: a.actor_name)
+
+
+def test_update_compact():
+    from periodiq import Scheduler
+
+    actors = [declare('a%d' % i, cron('@daily')) for i in range(10)]
+    scheduler = Scheduler(actors=actors)
+    now = pendulum.datetime(2019, 6, 15, 10, 30, tz='UTC')
+    scheduler.pop_due(now)
+    for _ in range(5):
+        scheduler.update(actors[:2], now)
+        actors = [declare('a%d' % i, cron('@hourly')) for i in range(10)]
+        scheduler.update(actors, now)
+    assert len(scheduler.queue) <= 2 * len(actors)
+
+
+def test_reload_wakes_up():
+    from threading import Thread
+    from time import monotonic
+    from periodiq import Scheduler
+
+    hourly = declare('hourly', cron('@hourly'))
+    scheduler = Scheduler(actors=[hourly])
+    thread = Thread(target=scheduler.reload, args=([],))
+    thread.start()
+    start = monotonic()
+    assert scheduler.wait(start + 60)
+    assert monotonic() - start < 5
+    thread.join()
+
+    # Actors are applied on next tick.
+    assert 1 == len(scheduler.pending)
+    scheduler.tick(pendulum.now())
+    assert [] == scheduler.actors
+    assert not scheduler.pending
+    assert scheduler.next_wakeup() is None
+
+
+def test_reloader(tmp_path, monkeypatch):
+    from periodiq import collect_actors, Reloader, Scheduler
+
+    source = dedent("""\
+    from dramatiq.brokers.stub import StubBroker
+    from dramatiq import actor
+    from periodiq import cron, PeriodiqMiddleware
+
+    broker = StubBroker()
+    broker.add_middleware(PeriodiqMiddleware())
+
+    @actor(broker=broker, periodic=cron(%r))
+    def first():
+        pass
+
+    @actor(broker=broker, periodic=cron('@daily'))
+    def second():
+        pass
+    """)
+    path = tmp_path / 'reloadable.py'
+    path.write_text(source % '@hourly')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    import reloadable
+
+    def collect():
+        broker = sys.modules['reloadable'].broker
+        return broker, collect_actors(broker)
+
+    scheduler = Scheduler(actors=collect_actors(reloadable.broker))
+    reloader = Reloader(scheduler, ['reloadable'], collect, interval=.01)
+    path.write_text(source.replace('second', 'third') % '@weekly')
+
+    assert reloader.reload()
+    actors, _, _ = scheduler.pending.pop()
+    specs = dict((a.actor_name, str(a.options['periodic'])) for a in actors)
+    assert {'first': '@weekly', 'third': '@daily'} == specs
+
+    # Watch reloads on change.
+    reloader.start()
+    path.write_text(source % '@monthly')
+    for _ in range(100):
+        if scheduler.pending:
+            break
+        sleep(.05)
+    actors, _, _ = scheduler.pending.pop()
+    assert ['first', 'second'] == sorted(a.actor_name for a in actors)
+
+    reloader.stop()
+
+    # Syntax error keeps current actors.
+    path.write_text('def broken(:\n')
+    assert not reloader.reload()
+    assert not scheduler.pending
+    assert 2 == len(collect()[1])
+
+    # Failing collect keeps reloader alive.
+    del sys.modules['reloadable']
+    assert not reloader.reload()
+
+
+def test_reload_keeps_registry(tmp_path, monkeypatch):
+    from periodiq import Reloader, Scheduler, SQLiteSchedules
+
+    # Actors module sends dynamic schedules while it is re-imported, as
+    # scheduler thread would.
+    (tmp_path / 'registry_broker.py').write_text(dedent("""\
+    from dramatiq.brokers.stub import StubBroker
+
+    broker = StubBroker()
+    hooks = []
+    """))
+    (tmp_path / 'registry_actors.py').write_text(dedent("""\
+    from dramatiq import actor
+    from registry_broker import broker, hooks
+
+    for hook in hooks:
+        hook()
+
+    @actor(broker=broker)
+    def report():
+        pass
+    """))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    import registry_actors
+    import registry_broker
+    target = registry_broker.broker
+
+    now = pendulum.datetime(2019, 6, 15, 12, tz='UTC')
+    store = SQLiteSchedules(':memory:')
+    store.add('acme', 'report', '* * * * *', now=now.subtract(minutes=1))
+    scheduler = Scheduler(actors=[], schedules=store, broker=target)
+    registry_broker.hooks.append(lambda: scheduler.send_schedules(now))
+
+    former = registry_actors.report
+    reloader = Reloader(
+        scheduler, ['registry_actors'], lambda: (target, []))
+    try:
+        assert reloader.reload()
+    finally:
+        del sys.modules['registry_actors']
+        del sys.modules['registry_broker']
+    # Former actor was found while its module reloaded.
+    assert 1 == target.queues['default'].qsize()
+    assert target.actors['report'] is not former
+    scheduler.tick(now)
+    assert scheduler.registry is target.actors
+
+
+def test_loop_without_actors():
+    from threading import Thread
+    from periodiq import Scheduler
+
+    hourly = declare('hourly', cron('@hourly'))
+    scheduler = Scheduler(actors=[hourly])
+    errors = []
+
+    def loop():
+        try:
+            scheduler.loop()
+        except Exception as e:
+            errors.append(e)
+
+    thread = Thread(target=loop)
+    thread.start()
+    # Reloading no actor leaves nothing to wait for, until stop.
+    scheduler.reload([])
+    sleep(.1)
+    assert thread.is_alive()
+    scheduler.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [] == errors
+    assert [] == scheduler.actors
@@ -0,0 +1,360 @@
+import logging
+import sys
+
+from pendulum import datetime
+
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import Message, actor
+
+from periodiq import cron, every, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('* * * * *'))
+def minutely():
+    pass
+
+
+@actor(broker=broker, periodic=cron('*/15 * * * *'))
+def quarthourly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('@hourly'))
+def hourly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('0 9 * * *', tz='Asia/Tokyo'))
+def tokyo():
+    pass
+
+
+@actor(broker=broker, periodic=cron('0 9 * * *', tz='Europe/Paris'))
+def paris():
+    pass
+
+
+@actor(broker=broker, periodic=every(seconds=5))
+def fivesecondly():
+    pass
+
+
+@actor(
+    broker=broker, periodic=cron('@hourly'), periodic_spread=60)
+def spread_hourly():
+    pass
+
+
+def test_pop_due():
+    from periodiq import Scheduler
+
+    scheduler = Scheduler(actors=[minutely, quarthourly, hourly])
+
+    # First wakeup sends actors matching current minute.
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 0, 10))
+    assert {minutely, quarthourly, hourly} == {a for _, a in due}
+    assert {datetime(2019, 6, 15, 12, 0)} == {d for d, _ in due}
+    assert datetime(2019, 6, 15, 12, 1) == scheduler.queue[0][2]
+
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 1))
+    assert [(datetime(2019, 6, 15, 12, 1), minutely)] == due
+
+    # Woke up a bit early, nothing is due yet.
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 1, 59))
+    assert [] == due
+
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 15))
+    assert {minutely, quarthourly} == {a for _, a in due}
+    assert 3 == len(scheduler.queue)
+
+
+def test_pop_due_late():
+    from periodiq import Scheduler
+
+    scheduler = Scheduler(actors=[minutely, hourly])
+    scheduler.pop_due(datetime(2019, 6, 15, 11, 59, 0))
+
+    # Several occurrences missed. Each actor is sent only once.
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 30))
+    assert {minutely, hourly} == {a for _, a in due}
+    dates = sorted(d for _, _, d, _ in scheduler.queue)
+    assert [datetime(2019, 6, 15, 12, 31), datetime(2019, 6, 15, 13)] == dates
+
+
+@actor(broker=broker, queue_name='other', periodic=cron('@daily'))
+def other_queue():
+    pass
+
+
+def test_send_actors():
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    now = datetime(2019, 6, 15, 0, 0)
+    actors = [minutely, quarthourly, hourly, other_queue]
+    for workers in 1, 8:
+        scheduler = Scheduler(actors=actors, send_workers=workers)
+        scheduler.send_actors(actors, now=now)
+        assert 3 == broker.queues['default'].qsize()
+        assert 1 == broker.queues['other'].qsize()
+        broker.flush_all()
+
+
+class BatchBroker(StubBroker):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def enqueue_many(self, messages):
+        self.batches.append([m.actor_name for m in messages])
+        for message in messages:
+            self.enqueue(message)
+
+
+def test_send_actors_batch():
+    from periodiq import Scheduler
+
+    batch_broker = BatchBroker()
+    actors = [
+        actor(fn, broker=batch_broker, actor_name=name, queue_name=queue)
+        for fn, name, queue in [
+            (lambda: None, 'a', 'default'),
+            (lambda: None, 'b', 'other'),
+            (lambda: None, 'c', 'default'),
+        ]
+    ]
+    scheduler = Scheduler(actors=actors)
+    scheduler.send_actors(actors, now=datetime(2019, 6, 15, 0, 0))
+    assert [['a', 'c'], ['b']] == sorted(batch_broker.batches)
+    assert 2 == batch_broker.queues['default'].qsize()
+
+
+def test_loop_stop():
+    from threading import Thread
+    from time import sleep
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[minutely])
+    thread = Thread(target=scheduler.loop)
+    thread.start()
+    # Actors matching current minute are sent on first wake up.
+    for _ in range(50):
+        if broker.queues['default'].qsize():
+            break
+        sleep(.1)
+    scheduler.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert broker.queues['default'].qsize()
+    broker.flush_all()
+
+
+def test_wait():
+    from time import monotonic
+    from periodiq import Scheduler
+
+    scheduler = Scheduler(actors=[minutely])
+    deadline = monotonic() + .02
+    assert not scheduler.wait(deadline)
+    assert monotonic() >= deadline
+
+    scheduler.stop()
+    assert scheduler.wait(monotonic() + 60)
+
+
+def test_catch_up(tmp_path):
+    from periodiq import FileCheckpoint, Scheduler
+
+    broker.flush_all()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+
+    def tick(catch_up):
+        checkpoint.save({
+            'quarthourly': datetime(2019, 6, 15, 11, 0),
+            'hourly': datetime(2019, 6, 15, 8, 0),
+        })
+        scheduler = Scheduler(
+            actors=[quarthourly, hourly], checkpoint=checkpoint,
+            catch_up=catch_up, catch_up_limit=3,
+        )
+        scheduler.tick(datetime(2019, 6, 15, 12, 10))
+        queue = broker.queues['default']
+        messages = [
+            Message.decode(queue.get_nowait()) for _ in range(queue.qsize())]
+        return [
+            (m.actor_name, m.options['scheduled_at'])
+            for m in messages if m.options.get('periodiq_backfill')
+        ]
+
+    assert [] == tick('none')
+    assert [
+        ('hourly', 1560600000000),
+        ('quarthourly', 1560600000000),
+    ] == sorted(tick('latest'))
+    # Up to 3 runs per actor.
+    assert 3 + 3 == len(tick('all'))
+
+    # Checkpoint is updated.
+    last_fired = checkpoint.load()
+    assert datetime(2019, 6, 15, 12, 0) == last_fired['quarthourly']
+
+
+def test_catch_up_seconds(tmp_path):
+    from periodiq import FileCheckpoint, Scheduler
+
+    broker.flush_all()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.save({'fivesecondly': datetime(2019, 6, 15, 12, 9, 0)})
+    scheduler = Scheduler(
+        actors=[fivesecondly], checkpoint=checkpoint, catch_up='all')
+    scheduler.tick(datetime(2019, 6, 15, 12, 10))
+    queue = broker.queues['default']
+    messages = [
+        Message.decode(queue.get_nowait()) for _ in range(queue.qsize())]
+    # Missed up to one second back, where first tick starts.
+    backfill = [m for m in messages if m.options.get('periodiq_backfill')]
+    assert 11 == len(backfill)
+    assert 12 == len(messages)
+
+
+def test_catch_up_spread(tmp_path):
+    from periodiq import FileCheckpoint, Scheduler
+
+    broker.flush_all()
+    checkpoint = FileCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.save({'minutely': datetime(2019, 6, 15, 11, 57)})
+    scheduler = Scheduler(
+        actors=[minutely], checkpoint=checkpoint, catch_up='all', spread=60)
+    offset = scheduler.offset(minutely)
+    assert offset > 1
+    # 11:59 run, due at 11:59 plus offset, is sent once, not as missed too.
+    scheduler.tick(datetime(2019, 6, 15, 12).add(seconds=offset / 2))
+    queue = broker.queues['default']
+    keys = [
+        Message.decode(queue.get_nowait()).options['periodiq_key']
+        for _ in range(queue.qsize())]
+    assert ['minutely@1560599880', 'minutely@1560599940'] == keys
+
+
+def test_idempotency_key():
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[hourly])
+    scheduler.send_actors([hourly], now=datetime(2019, 6, 15, 12, 0))
+    message = Message.decode(broker.queues['default'].get_nowait())
+    assert 'hourly@1560600000' == message.options['periodiq_key']
+
+
+def test_log_fields(caplog):
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[hourly])
+    caplog.set_level(logging.DEBUG, logger='periodiq')
+    scheduler.send_actors([hourly], now=datetime(2019, 6, 15, 12, 0))
+    record, = caplog.records
+    assert logging.DEBUG == record.levelno
+    assert 'hourly' == record.actor
+    assert 1560600000000 == record.scheduled_at
+
+    caplog.clear()
+    caplog.set_level(logging.INFO, logger='periodiq')
+    scheduler.send_actors([hourly], now=datetime(2019, 6, 15, 13, 0))
+    assert [] == caplog.records
+
+
+def test_log_queue(capsys):
+    from periodiq import logger, setup_logging
+
+    handlers = logger.handlers[:]
+    del logger.handlers[:]
+    # Ignore pytest handlers on root logger.
+    logger.propagate = False
+    try:
+        listener = setup_logging(0, log_queue=True)
+        logger.debug("Hidden without -v.")
+        logger.info("Queued %s.", 'record')
+        listener.stop()
+        del logger.handlers[:]
+        setup_logging(1)
+        assert not logger.propagate
+        logger.debug("Shown with -v.")
+        del logger.handlers[:]
+
+        # Application configured root logger, don't print records twice.
+        logger.propagate = True
+        root = logging.getLogger()
+        root.addHandler(logging.StreamHandler(sys.stdout))
+        try:
+            assert setup_logging(0) is None
+            assert not logger.handlers
+            logger.info("Printed once.")
+        finally:
+            root.removeHandler(root.handlers[-1])
+    finally:
+        logger.handlers[:] = handlers
+        logger.propagate = True
+
+    assert "[INFO] Queued record.\n[DEBUG] Shown with -v.\nPrinted once.\n" \
+        == capsys.readouterr().out
+
+
+def test_pop_due_timezones():
+    from periodiq import Scheduler
+
+    scheduler = Scheduler(actors=[paris, tokyo])
+    assert [] == scheduler.pop_due(datetime(2019, 6, 15, 12, 30))
+    # Tokyo fires first, at midnight UTC.
+    due = scheduler.pop_due(datetime(2019, 6, 16, 0, 0, 1))
+    assert [tokyo] == [a for _, a in due]
+    assert datetime(2019, 6, 16) == due[0][0].in_timezone('UTC')
+    due = scheduler.pop_due(datetime(2019, 6, 16, 7, 0, 1))
+    assert [paris] == [a for _, a in due]
+    assert 9 == due[0][0].hour
+
+
+def test_pop_due_seconds():
+    from periodiq import Scheduler
+
+    scheduler = Scheduler(actors=[fivesecondly, minutely])
+    # Sub-minute actor is due if matching current second only.
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 0, 3))
+    assert [minutely] == [a for _, a in due]
+    due = scheduler.pop_due(datetime(2019, 6, 15, 12, 0, 5))
+    assert [(datetime(2019, 6, 15, 12, 0, 5), fivesecondly)] == due
+    assert datetime(2019, 6, 15, 12, 0, 10) == scheduler.queue[0][2]
+
+
+def test_spread():
+    from periodiq import Scheduler
+
+    broker.flush_all()
+    scheduler = Scheduler(actors=[spread_hourly, hourly, minutely], spread=30)
+    offset = scheduler.offset(spread_hourly)
+    assert 0 <= offset < 60
+    assert offset == Scheduler(actors=[]).offset(spread_hourly)
+    assert 0 <= scheduler.offset(hourly) < 30
+    assert scheduler.offset(hourly) != scheduler.offset(minutely)
+
+    scheduler.pop_due(datetime(2019, 6, 15, 11, 59, 59))
+    base = datetime(2019, 6, 15, 12)
+    # Not due at base date, but at base date plus offset.
+    due = scheduler.pop_due(base.add(seconds=offset - .01))
+    assert spread_hourly not in [a for _, a in due]
+    due = scheduler.pop_due(base.add(seconds=offset))
+    assert (base, spread_hourly) in due
+    # Next run is searched from base date.
+    assert (base.add(hours=1), spread_hourly) in [
+        (d, a) for _, _, d, a in scheduler.queue]
+
+    scheduler.send_actors([spread_hourly], now=base)
+    message = Message.decode(broker.queues['default'].get_nowait())
+    assert int((base.timestamp() + offset) * 1000) == (
+        message.options['scheduled_at'])
+    assert 'spread_hourly@1560600000' == message.options['periodiq_key']
@@ -0,0 +1,130 @@
+from pendulum import datetime
+
+import pytest
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import Message, actor
+
+from periodiq import PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker)
+def report(tenant, format='pdf'):
+    pass
+
+
+def check_store(store):
+    from periodiq import cron, every
+
+    now = datetime(2019, 6, 15, 11, 59, 30)
+    store.add('acme', 'report', cron('0 12 * * *'), args=['acme'], now=now)
+    store.add('initech', 'report', '30 12 * * *', args=['initech'],
+              kwargs=dict(format='csv'), now=now)
+    store.add('poll', 'report', every(seconds=10), args=['poll'], now=now)
+    store.add('gone', 'report', '* * * * *', now=now)
+    store.remove('gone')
+    assert datetime(2019, 6, 15, 11, 59, 40).timestamp() == store.next_fire()
+
+    assert [] == store.pop_due(datetime(2019, 6, 15, 11, 59, 39))
+    due = store.pop_due(datetime(2019, 6, 15, 12, 0, 1))
+    assert [
+        ('poll', 'report', ['poll'], {},
+         datetime(2019, 6, 15, 11, 59, 40).timestamp()),
+        ('acme', 'report', ['acme'], {},
+         datetime(2019, 6, 15, 12).timestamp()),
+    ] == due
+    # Rescheduled after now, missed runs are skipped.
+    due = store.pop_due(datetime(2019, 6, 15, 12, 30))
+    assert [
+        ('poll', 'report', ['poll'], {},
+         datetime(2019, 6, 15, 12, 0, 10).timestamp()),
+        ('initech', 'report', ['initech'], dict(format='csv'),
+         datetime(2019, 6, 15, 12, 30).timestamp()),
+    ] == due
+
+    # Bounded reads.
+    assert 1 == len(store.pop_due(datetime(2019, 6, 16, 12), limit=1))
+
+
+def check_concurrent(stores):
+    # Schedulers sharing a store never pop the same run.
+    from threading import Thread
+
+    now = datetime(2019, 6, 15, 11, 59, 30)
+    for i in range(200):
+        stores[0].add('tenant%d' % i, 'report', '0 12 * * *', now=now)
+    popped = []
+
+    def pop(store):
+        while True:
+            due = store.pop_due(datetime(2019, 6, 15, 12, 0, 1), limit=7)
+            if not due:
+                break
+            popped.extend(schedule_id for schedule_id, *_ in due)
+
+    threads = [Thread(target=pop, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 200 == len(popped)
+    assert 200 == len(set(popped))
+
+
+def test_sqlite(tmp_path):
+    from periodiq import SQLiteSchedules
+
+    check_store(SQLiteSchedules(str(tmp_path / 'schedules.db')))
+
+
+def test_redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import RedisSchedules
+
+    check_store(RedisSchedules(fakeredis.FakeRedis()))
+
+
+def test_sqlite_concurrent(tmp_path):
+    from periodiq import SQLiteSchedules
+
+    path = str(tmp_path / 'schedules.db')
+    check_concurrent([SQLiteSchedules(path) for _ in range(4)])
+
+
+def test_redis_concurrent():
+    fakeredis = pytest.importorskip('fakeredis')
+    from periodiq import RedisSchedules
+
+    server = fakeredis.FakeServer()
+    check_concurrent([
+        RedisSchedules(fakeredis.FakeRedis(server=server)) for _ in range(4)])
+
+
+def test_send_schedules():
+    from periodiq import Scheduler, SQLiteSchedules
+
+    store = SQLiteSchedules(':memory:')
+    now = datetime(2019, 6, 15, 11, 59, 30)
+    for i in range(5):
+        store.add('tenant%d' % i, 'report', '0 12 * * *',
+                  args=['tenant%d' % i], now=now)
+    store.add('typo', 'reprot', '0 12 * * *', now=now)
+    scheduler = Scheduler(
+        actors=[], schedules=store, broker=broker, poll_interval=60)
+    assert datetime(2019, 6, 15, 12) == scheduler.next_wakeup(now)
+    scheduler.poll_interval = 1
+    assert datetime(2019, 6, 15, 11, 59, 31) == scheduler.next_wakeup(now)
+
+    broker.flush_all()
+    scheduler.send_schedules(datetime(2019, 6, 15, 12, 0, 1), limit=2)
+    queue = broker.queues['default']
+    messages = [
+        Message.decode(queue.get_nowait()) for _ in range(queue.qsize())]
+    assert 5 == len(messages)
+    message = sorted(messages, key=lambda m: m.args)[0]
+    assert ('tenant0',) == message.args
+    assert 1560600000000 == message.options['scheduled_at']
+    assert 'tenant0@1560600000' == message.options['periodiq_key']
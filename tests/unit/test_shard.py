@@ -0,0 +1,61 @@
+from dramatiq.brokers.stub import StubBroker
+from dramatiq import Message, actor
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+def test_shard_of():
+    from periodiq import shard_of
+
+    names = ['actor%d' % i for i in range(2000)]
+    shards = [shard_of(n, 4) for n in names]
+    assert {0, 1, 2, 3} == set(shards)
+    # Roughly balanced.
+    assert all(300 < shards.count(i) < 700 for i in range(4))
+
+    # Adding a shard moves about a fifth of actors, only to new shard.
+    moved = [
+        (old, shard_of(n, 5)) for n, old in zip(names, shards)
+        if shard_of(n, 5) != old
+    ]
+    assert len(moved) < len(names) * .3
+    assert {4} == {new for _, new in moved}
+
+
+def test_parse_shard():
+    from argparse import ArgumentTypeError
+    import pytest
+    from periodiq import parse_shard
+
+    assert (1, 3) == parse_shard('1/3')
+    for value in '3/3', 'a/3', '1':
+        with pytest.raises(ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_sharded_schedulers():
+    from periodiq import Scheduler, shard_of
+
+    broker = StubBroker()
+    broker.add_middleware(PeriodiqMiddleware())
+    actors = [
+        actor(
+            lambda: None, broker=broker, actor_name='actor%d' % i,
+            periodic=cron('* * * * *'),
+        )
+        for i in range(30)
+    ]
+
+    count = 3
+    schedulers = [
+        Scheduler([a for a in actors if shard_of(a.actor_name, count) == i])
+        for i in range(count)
+    ]
+    for scheduler in schedulers:
+        scheduler.schedule()
+
+    queue = broker.queues['default']
+    sent = [queue.get_nowait() for _ in range(queue.qsize())]
+    names = sorted(Message.decode(m).actor_name for m in sent)
+    # Each actor is sent once, by a single scheduler.
+    assert sorted(a.actor_name for a in actors) == names
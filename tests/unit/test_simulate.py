@@ -0,0 +1,91 @@
+from io import StringIO
+
+import pendulum
+from dramatiq import actor
+from dramatiq.brokers.stub import StubBroker
+
+from periodiq import cron, PeriodiqMiddleware
+
+
+broker = StubBroker()
+broker.add_middleware(PeriodiqMiddleware())
+
+
+@actor(broker=broker, periodic=cron('@hourly', tz='Europe/Paris'))
+def hourly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('30 2 * * *', tz='Europe/Paris'))
+def nightly():
+    pass
+
+
+@actor(broker=broker, periodic=cron('0 9 * * *', tz='Asia/Tokyo'))
+def tokyo():
+    pass
+
+
+def test_simulation():
+    from periodiq import Simulation
+
+    # Europe/Paris skips 2:00 to 3:00 on 2019-03-31.
+    start = pendulum.datetime(2019, 3, 30, 12, tz='Europe/Paris')
+    end = start.add(days=1)
+    simulation = Simulation([hourly, nightly, tokyo], start, end)
+    simulation.loop()
+    assert not broker.queues['default'].qsize()
+
+    runs = [
+        (pendulum.from_timestamp(t, tz='Europe/Paris'), a.actor_name)
+        for t, a in simulation.runs]
+    # End is included. 23 hours elapse on DST day.
+    assert 25 == len(runs)
+    assert (start, 'hourly') == runs[0]
+    assert (end, 'hourly') == runs[-1]
+    assert 'nightly' not in [a for _, a in runs]
+    tokyo_date = pendulum.datetime(2019, 3, 31, 1, tz='Europe/Paris')
+    assert (tokyo_date, 'tokyo') in runs
+
+    load = simulation.load()
+    assert 25 == sum(load.values())
+    assert 2 == load[tokyo_date.timestamp()]
+
+    out = StringIO()
+    simulation.write(out)
+    lines = out.getvalue().splitlines()
+    assert 'run\t2019-03-30T12:00:00+01:00\thourly' == lines[0]
+    assert 'load\t2019-03-30T12:00:00+01:00\t1' == lines[25]
+    assert 25 + len(load) == len(lines)
+
+
+def test_virtual_clock():
+    from periodiq import VirtualClock
+
+    start = pendulum.datetime(2019, 10, 27, 0, 59).in_tz('Europe/Paris')
+    clock = VirtualClock(start, start.add(hours=2))
+    # Same wall-clock time, one hour later as DST ends.
+    later = pendulum.from_timestamp(
+        start.timestamp() + 3600, tz='Europe/Paris')
+    assert (later.hour, later.minute) == (start.hour, start.minute)
+    assert clock.sleep_until(later)
+    assert later.timestamp() == clock.now().timestamp()
+    assert clock.sleep_until(start)
+    assert later.timestamp() == clock.now().timestamp()
+    assert not clock.sleep_until(start.add(hours=3))
+    assert not clock.sleep_until(None)
+
+
+def test_parse_date():
+    from argparse import ArgumentTypeError
+    from periodiq import parse_date
+
+    date = parse_date('2019-06-15T12:00+02:00')
+    assert pendulum.datetime(2019, 6, 15, 10) == date
+    assert pendulum.local_timezone().name == parse_date('2019-06-15').tz.name
+    try:
+        parse_date('tomorrow')
+    except ArgumentTypeError:
+        pass
+    else:
+        raise AssertionError("Invalid date accepted.")